@@ -1,137 +1,27 @@
 import sys
 import os
-import glob
-import json
-import time
-from collections import defaultdict
-import pandas as pd
-from openpyxl import load_workbook
+import traceback
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QPushButton, QLabel, QFileDialog, 
                              QLineEdit, QTextEdit, QProgressBar, QCheckBox,
                              QMessageBox, QTableWidget, QTableWidgetItem, 
-                             QHeaderView, QDialog, QFormLayout, QComboBox)
-from PyQt5.QtCore import Qt, QTimer, QSettings
-
-class TemplateManager:
-    def __init__(self):
-        self.template_file = "templates.json"  # Всегда в папке программы
-        self.templates = []
-        self.load_templates()
-        
-    def load_templates(self):
-        """Загружает шаблоны из JSON файла в папке программы"""
-        try:
-            if os.path.exists(self.template_file):
-                with open(self.template_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.templates = data.get('templates', [])
-                return True
-            else:
-                # Создаем пустой файл с шаблонами
-                self.save_templates()
-                return True
-        except Exception as e:
-            print(f"Error loading templates: {e}")
-            self.templates = []
-            return False
-    
-    def save_templates(self):
-        """Сохраняет шаблоны в JSON файл"""
-        try:
-            with open(self.template_file, 'w', encoding='utf-8') as f:
-                json.dump({"templates": self.templates}, f, ensure_ascii=False, indent=2)
-            return True
-        except Exception as e:
-            print(f"Error saving templates: {e}")
-            return False
-    
-    def generate_fingerprint(self, cells):
-        """Генерирует fingerprint из списка ячеек"""
-        # Сортируем ячейки по row, затем col
-        sorted_cells = sorted(cells, key=lambda x: (x['row'], x['col']))
-        
-        # Создаем части fingerprint
-        parts = []
-        for cell in sorted_cells:
-            part = f"{cell['rowspan']}x{cell['colspan']}_{cell['row']}_{cell['col']}_{str(cell['required']).lower()}"
-            parts.append(part)
-        
-        return "|".join(parts)
-    
-    def find_template(self, sheet_name, group_fingerprint, has_uvnk):
-        """Ищет шаблон для группы"""
-        for template in self.templates:
-            # Проверяем, что подстрока sheet содержится в названии листа
-            # И что режим увнк совпадает
-            if (template['sheet'] in sheet_name and 
-                template['fingerprint'] == group_fingerprint and
-                template.get('has_uvnk', False) == has_uvnk):
-                return template
-        return None
-    
-    def create_new_template(self, sheet_name, group_cells, has_uvnk, description=""):
-        """Создает новый шаблон из группы ячеек"""
-        # Создаем cells для fingerprint (без значений)
-        cells_for_fingerprint = []
-        for cell in group_cells:
-            cells_for_fingerprint.append({
-                'row': cell['row'],
-                'col': cell['col'],
-                'rowspan': cell['rowspan'],
-                'colspan': cell['colspan'],
-                'required': cell['required']
-            })
-        
-        fingerprint = self.generate_fingerprint(cells_for_fingerprint)
-        
-        # Создаем ячейки для шаблона
-        template_cells = []
-        for cell in group_cells:
-            template_cell = {
-                'row': cell['row'],
-                'col': cell['col'],
-                'rowspan': cell['rowspan'],
-                'colspan': cell['colspan'],
-                'required': cell['required'],
-                'output_column': '',  # Пользователь заполнит позже
-                'example': cell.get('value', ''),
-                'absolute_position': {
-                    'row': cell.get('absolute_row', 0),
-                    'col': cell.get('absolute_col', 0)
-                }
-            }
-            template_cells.append(template_cell)
-        
-        new_template = {
-            'id': f'template_{int(time.time())}_{len(self.templates)}',
-            'name': f'Автошаблон для {sheet_name}',
-            'sheet': sheet_name,
-            'has_uvnk': has_uvnk,
-            'description': description,
-            'fingerprint': fingerprint,
-            'cells': template_cells
-        }
-        
-        self.templates.append(new_template)
-        self.save_templates()
-        
-        return new_template
-    
-    def update_template(self, template_id, updates):
-        """Обновляет существующий шаблон"""
-        for template in self.templates:
-            if template['id'] == template_id:
-                template.update(updates)
-                self.save_templates()
-                return True
-        return False
+                             QHeaderView, QDialog, QFormLayout, QComboBox,
+                             QSpinBox)
+from PyQt5.QtCore import Qt, QTimer, QSettings, QObject, QThread, pyqtSignal
+from greenTableTemplates import TemplateManager
+from greenTableEngine import process_files, find_excel_files
+from greenTableOutput import open_sink, close_sink
+from greenTableCache import ResultCache, Quarantine
+from greenTableTelemetry import MatchTelemetry
+from greenTableProfile import RunProfile
 
 class TemplateEditorDialog(QDialog):
     """Диалог для редактирования шаблона"""
-    def __init__(self, template, parent=None):
+    def __init__(self, template, examples=None, parent=None):
         super().__init__(parent)
         self.template = template
+        # Примеры по ячейкам (могут храниться отдельно от шаблона)
+        self.examples = examples or [{} for _ in template['cells']]
         self.init_ui()
         
     def init_ui(self):
@@ -169,7 +59,7 @@ class TemplateEditorDialog(QDialog):
             self.table.setItem(i, 4, QTableWidgetItem(str(cell['required'])))
             
             # Пример значения
-            example = cell.get('example', '')
+            example = self.examples[i].get('example', '')
             if example is None:
                 example = ''
             example_str = str(example)
@@ -178,7 +68,7 @@ class TemplateEditorDialog(QDialog):
             self.table.setItem(i, 5, QTableWidgetItem(example_str))
             
             # Абсолютная позиция
-            abs_pos = cell.get('absolute_position', {})
+            abs_pos = self.examples[i].get('absolute_position') or {}
             pos_str = f"R{abs_pos.get('row', 0)}C{abs_pos.get('col', 0)}"
             self.table.setItem(i, 6, QTableWidgetItem(pos_str))
             
@@ -226,13 +116,95 @@ class TemplateEditorDialog(QDialog):
                 'rowspan': int(self.table.item(i, 2).text()),
                 'colspan': int(self.table.item(i, 3).text()),
                 'required': self.table.item(i, 4).text().lower() == 'true',
-                'example': original_cell.get('example', ''),
-                'absolute_position': original_cell.get('absolute_position', {}),
                 'output_column': self.table.item(i, 7).text()
             }
+            # Вынесенные в отдельный файл примеры обратно в шаблон не попадают
+            for field in ('example', 'absolute_position'):
+                if field in original_cell:
+                    cell[field] = original_cell[field]
             cells.append(cell)
         return cells
 
+class ProcessingWorker(QObject):
+    """Обработка директории в отдельном потоке"""
+    log_message = pyqtSignal(str)
+    progress = pyqtSignal(int)
+    file_finished = pyqtSignal(str, int, bool)  # файл, строк извлечено, успех
+    finished = pyqtSignal(list)  # id новых шаблонов
+    
+    def __init__(self, template_manager, directory, output_file, auto_create, workers, use_cache,
+                 timeout=None, dedup=None, profile_file=None):
+        super().__init__()
+        self.template_manager = template_manager
+        self.directory = directory
+        self.output_file = output_file
+        self.auto_create = auto_create
+        self.workers = workers
+        self.use_cache = use_cache
+        self.timeout = timeout  # Предел времени на файл, секунд (None - без предела)
+        self.dedup = dedup      # Повторы файлов и листов: None, 'first' или 'tag'
+        self.profile_file = profile_file  # Куда сохранить профиль этапов (None - не снимать)
+        self._cancelled = False
+    
+    def cancel(self):
+        # Вызывается из потока интерфейса, флаг проверяется между файлами
+        self._cancelled = True
+    
+    def is_cancelled(self):
+        return self._cancelled
+    
+    def set_progress(self, file_idx, total_files):
+        self.progress.emit(int(file_idx / total_files * 100))
+    
+    def run(self):
+        new_templates_created = []
+        try:
+            self.log_message.emit("Scanning directory for Excel files...")
+            excel_files = find_excel_files(self.directory)
+            
+            if not excel_files:
+                self.log_message.emit("No Excel files found in the directory.")
+            else:
+                self.log_message.emit(f"Found {len(excel_files)} Excel files.")
+                
+                sink = open_sink(self.output_file)
+                profile = RunProfile() if self.profile_file else None
+                _, new_templates_created = process_files(
+                    excel_files,
+                    self.template_manager,
+                    auto_create=self.auto_create,
+                    workers=self.workers,
+                    log=self.log_message.emit,
+                    progress=self.set_progress,
+                    file_done=self.file_finished.emit,
+                    cancelled=self.is_cancelled,
+                    cache=ResultCache() if self.use_cache else None,
+                    sink=sink,
+                    profile=profile,
+                    timeout=self.timeout,
+                    quarantine=Quarantine(),
+                    dedup=self.dedup,
+                    telemetry=MatchTelemetry()
+                )
+                
+                if self._cancelled:
+                    # Неполный результат не должен затирать прежний выходной файл
+                    sink.abort()
+                    self.log_message.emit(f"Output file {self.output_file} was not written")
+                else:
+                    close_sink(sink, self.template_manager, self.log_message.emit, profile)
+                    if profile is not None:
+                        profile.save(self.profile_file)
+                        self.log_message.emit(f"Profile saved to {self.profile_file}")
+                    self.progress.emit(100)
+            
+        except Exception as e:
+            self.log_message.emit(f"Error: {str(e)}")
+            self.log_message.emit(traceback.format_exc())
+            self.progress.emit(0)
+        
+        self.finished.emit(new_templates_created)
+
 class ExcelParserApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -240,6 +212,8 @@ class ExcelParserApp(QMainWindow):
         self.settings = QSettings("ExcelParser", "TemplateSystem")
         self.template_manager = TemplateManager()
         self.unprocessed_templates = []  # Шаблоны без output_column
+        self.worker = None
+        self.worker_thread = None
         self.initUI()
         
     def initUI(self):
@@ -297,12 +271,60 @@ class ExcelParserApp(QMainWindow):
         auto_create_saved = self.settings.value("auto_create", True, type=bool)
         self.auto_create_checkbox.setChecked(auto_create_saved)
         
+        # Повторное использование результатов неизмененных файлов
+        self.use_cache_checkbox = QCheckBox("Reuse cached results for unchanged files")
+        self.use_cache_checkbox.setChecked(self.settings.value("use_cache", True, type=bool))
+        
+        # Время этапов и счетчики запуска (как --profile в greenTableCli) рядом с выходным файлом
+        self.save_profile_checkbox = QCheckBox("Save a stage profile next to the output file (.profile.json)")
+        self.save_profile_checkbox.setChecked(self.settings.value("save_profile", False, type=bool))
+        
+        # Количество процессов для параллельной обработки файлов
+        workers_layout = QHBoxLayout()
+        self.workers_label = QLabel('Worker processes:')
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, 64)
+        self.workers_spin.setValue(self.settings.value("workers", os.cpu_count() or 1, type=int))
+        workers_layout.addWidget(self.workers_label)
+        workers_layout.addWidget(self.workers_spin)
+        
+        # Предел времени на файл: зависший файл убивается и попадает в карантин
+        self.timeout_label = QLabel('File time limit, s (0 - none):')
+        self.timeout_spin = QSpinBox()
+        self.timeout_spin.setRange(0, 24 * 3600)
+        self.timeout_spin.setValue(self.settings.value("file_timeout", 0, type=int))
+        workers_layout.addWidget(self.timeout_label)
+        workers_layout.addWidget(self.timeout_spin)
+        workers_layout.addStretch()
+        
+        # Копии журналов и одинаковые листы в разных файлах
+        dedup_layout = QHBoxLayout()
+        self.dedup_label = QLabel('Duplicate files and sheets:')
+        self.dedup_combo = QComboBox()
+        self.dedup_combo.addItem('Process every copy', None)
+        self.dedup_combo.addItem('Keep the first copy', 'first')
+        self.dedup_combo.addItem('Keep the first copy, list all sources', 'tag')
+        dedup_index = self.dedup_combo.findData(self.settings.value("dedup", None))
+        self.dedup_combo.setCurrentIndex(max(dedup_index, 0))
+        dedup_layout.addWidget(self.dedup_label)
+        dedup_layout.addWidget(self.dedup_combo)
+        dedup_layout.addStretch()
+        
         # Progress bar
         self.progress = QProgressBar()
         
         # Process button
+        process_layout = QHBoxLayout()
         self.process_btn = QPushButton('Process Excel Files')
         self.process_btn.clicked.connect(self.process_directory)
+        self.cancel_btn = QPushButton('Cancel')
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel_processing)
+        process_layout.addWidget(self.process_btn)
+        process_layout.addWidget(self.cancel_btn)
+        
+        # Статус текущего файла
+        self.status_label = QLabel('')
         
         # Log output
         self.log = QTextEdit()
@@ -317,8 +339,13 @@ class ExcelParserApp(QMainWindow):
         layout.addLayout(output_layout)
         layout.addLayout(template_buttons_layout)
         layout.addWidget(self.auto_create_checkbox)
+        layout.addWidget(self.use_cache_checkbox)
+        layout.addWidget(self.save_profile_checkbox)
+        layout.addLayout(workers_layout)
+        layout.addLayout(dedup_layout)
         layout.addWidget(self.progress)
-        layout.addWidget(self.process_btn)
+        layout.addWidget(self.status_label)
+        layout.addLayout(process_layout)
         layout.addWidget(self.clear_log_btn)
         layout.addWidget(self.log)
         
@@ -329,12 +356,32 @@ class ExcelParserApp(QMainWindow):
         self.settings.setValue("last_directory", self.dir_path.text())
         self.settings.setValue("last_output_file", self.output_path.text())
         self.settings.setValue("auto_create", self.auto_create_checkbox.isChecked())
+        self.settings.setValue("workers", self.workers_spin.value())
+        self.settings.setValue("use_cache", self.use_cache_checkbox.isChecked())
+        self.settings.setValue("file_timeout", self.timeout_spin.value())
+        self.settings.setValue("dedup", self.dedup_combo.currentData())
+        self.settings.setValue("save_profile", self.save_profile_checkbox.isChecked())
         self.settings.sync()  # Принудительно сохраняем настройки
         
     def closeEvent(self, event):
-        """Сохраняем настройки при закрытии программы"""
+        """Сохраняем настройки и шаблоны при закрытии программы"""
         self.save_settings()
+        if self.worker_thread is not None:
+            # Дожидаемся остановки обработки, чтобы не записывать шаблоны одновременно
+            self.worker.cancel()
+            self.worker_thread.wait()
+        self.template_manager.flush()
         event.accept()
+    
+    def set_controls_enabled(self, enabled):
+        """Блокирует элементы управления на время обработки"""
+        for widget in (self.dir_path, self.browse_btn, self.output_path, self.output_browse_btn,
+                       self.edit_templates_btn, self.reload_templates_btn,
+                       self.auto_create_checkbox, self.use_cache_checkbox, self.save_profile_checkbox,
+                       self.workers_spin,
+                       self.timeout_spin, self.dedup_combo, self.process_btn):
+            widget.setEnabled(enabled)
+        self.cancel_btn.setEnabled(not enabled)
         
     def browse_directory(self):
         directory = QFileDialog.getExistingDirectory(self, 'Select Directory')
@@ -352,7 +399,7 @@ class ExcelParserApp(QMainWindow):
             self, 
             'Save Output File', 
             last_output, 
-            'Excel Files (*.xlsx)'
+            'Excel Files (*.xlsx);;CSV Files (*.csv);;SQLite (*.sqlite *.db)'
         )
         if file_name:
             self.output_path.setText(file_name)
@@ -403,10 +450,11 @@ class ExcelParserApp(QMainWindow):
             template_id = template_combo.currentData()
             template = next((t for t in self.template_manager.templates if t['id'] == template_id), None)
             if template:
-                editor = TemplateEditorDialog(template, self)
+                editor = TemplateEditorDialog(template, self.template_manager.cell_examples(template), self)
                 if editor.exec_() == QDialog.Accepted:
                     updated_cells = editor.get_updated_cells()
                     self.template_manager.update_template(template_id, {'cells': updated_cells})
+                    self.template_manager.flush()
                     self.log_message(f"Template {template['name']} updated")
             dialog.accept()
         
@@ -426,322 +474,6 @@ class ExcelParserApp(QMainWindow):
         
     def log_message(self, message):
         self.log.append(message)
-        QApplication.processEvents()
-    
-    def analyze_group_structure(self, sheet, merged_ranges, group_start_row, col_start, col_end):
-        """Анализирует структуру группы и возвращает список ячеек"""
-        cells = []
-        processed_cells = set()
-        
-        # Проверяем, есть ли гигантская ячейка, покрывающая всю группу
-        for merged_range in merged_ranges:
-            if (merged_range.min_row <= group_start_row and 
-                merged_range.max_row >= group_start_row + 2 and
-                merged_range.min_col <= col_start and 
-                merged_range.max_col >= col_end):
-                # Гигантская ячейка покрывает всю группу
-                self.log_message(f"    WARNING: Giant cell covering entire group found at R{merged_range.min_row}C{merged_range.min_col}")
-                return []  # Возвращаем пустой список - группу пропускаем
-        
-        for row_offset in range(3):  # Группа всегда 3 строки
-            row_abs = group_start_row + row_offset
-            col_abs = col_start
-            
-            while col_abs <= col_end:
-                # Пропускаем уже обработанные ячейки
-                if (row_abs, col_abs) in processed_cells:
-                    col_abs += 1
-                    continue
-                
-                # Проверяем, является ли ячейка частью объединения
-                is_merged = False
-                rowspan = 1
-                colspan = 1
-                start_row_abs = row_abs
-                start_col_abs = col_abs
-                
-                for merged_range in merged_ranges:
-                    if merged_range.min_row <= row_abs <= merged_range.max_row and \
-                       merged_range.min_col <= col_abs <= merged_range.max_col:
-                        # Это объединенная ячейка
-                        is_merged = True
-                        rowspan = merged_range.max_row - merged_range.min_row + 1
-                        colspan = merged_range.max_col - merged_range.min_col + 1
-                        start_row_abs = merged_range.min_row
-                        start_col_abs = merged_range.min_col
-                        
-                        # Проверяем, является ли эта ячейка верхней левой в объединении
-                        if row_abs == merged_range.min_row and col_abs == merged_range.min_col:
-                            # Это начало объединения - добавляем ячейку
-                            cell_value = sheet.cell(merged_range.min_row, merged_range.min_col).value
-                            has_data = cell_value is not None and str(cell_value).strip() != ''
-                            
-                            cells.append({
-                                'row': row_offset,
-                                'col': col_abs - col_start,
-                                'rowspan': rowspan,
-                                'colspan': colspan,
-                                'required': has_data,
-                                'value': cell_value,
-                                'absolute_row': merged_range.min_row,
-                                'absolute_col': merged_range.min_col
-                            })
-                        
-                        # Помечаем все ячейки этого объединения как обработанные
-                        for r in range(merged_range.min_row, merged_range.max_row + 1):
-                            for c in range(merged_range.min_col, merged_range.max_col + 1):
-                                processed_cells.add((r, c))
-                        
-                        # Перескакиваем на следующий столбец после объединения
-                        col_abs = merged_range.max_col
-                        break
-                
-                if not is_merged:
-                    # Обычная ячейка
-                    cell_value = sheet.cell(row_abs, col_abs).value
-                    has_data = cell_value is not None and str(cell_value).strip() != ''
-                    
-                    cells.append({
-                        'row': row_offset,
-                        'col': col_abs - col_start,
-                        'rowspan': 1,
-                        'colspan': 1,
-                        'required': has_data,
-                        'value': cell_value,
-                        'absolute_row': row_abs,
-                        'absolute_col': col_abs
-                    })
-                    
-                    processed_cells.add((row_abs, col_abs))
-                
-                col_abs += 1
-        
-        return cells
-    
-    def extract_data_with_template(self, group_cells, template):
-        """Извлекает данные из группы с использованием шаблона"""
-        data = {}
-        
-        # Извлекаем данные по шаблону
-        for cell_def in template['cells']:
-            output_column = cell_def.get('output_column', '')
-            if output_column and output_column.strip():  # Только если output_column задан и не пустой
-                # Находим соответствующую ячейку в группе
-                for cell in group_cells:
-                    if (cell['row'] == cell_def['row'] and 
-                        cell['col'] == cell_def['col'] and
-                        cell['rowspan'] == cell_def['rowspan'] and
-                        cell['colspan'] == cell_def['colspan']):
-                        data[output_column] = cell.get('value', '')
-                        break
-                else:
-                    # Если ячейка не найдена, оставляем пустое значение
-                    data[output_column] = ''
-        
-        return data
-    
-    def process_sheet(self, workbook, sheet_name):
-        """Обработка отдельного листа с новой логикой шаблонов"""
-        sheet = workbook[sheet_name]
-        self.log_message(f"Processing sheet: {sheet_name}")
-        
-        # Определяем режим работы на основе названия листа
-        has_uvnk = 'увнк' in sheet_name.lower()
-        self.log_message(f"Режим работы: {'с УВНК' if has_uvnk else 'без УВНК'}")
-        
-        merged_ranges = list(sheet.merged_cells.ranges)
-        self.log_message(f"Found {len(merged_ranges)} merged cell ranges.")
-        
-        # Вспомогательная функция для получения значения с учетом объединенных ячеек
-        def get_cell_value(row, col):
-            for merged_range in merged_ranges:
-                if merged_range.min_row <= row <= merged_range.max_row and \
-                   merged_range.min_col <= col <= merged_range.max_col:
-                    return sheet.cell(merged_range.min_row, merged_range.min_col).value
-            return sheet.cell(row, col).value
-        
-        # Находим пустые строки для разделения на цепочки
-        empty_rows = []
-        for row_idx in range(1, sheet.max_row + 1):
-            is_empty = True
-            has_fill = False
-            
-            for col_idx in range(1, sheet.max_column + 1):
-                cell_value = get_cell_value(row_idx, col_idx)
-                if cell_value is not None and str(cell_value).strip() != '':
-                    is_empty = False
-                    break
-                
-                cell = sheet.cell(row=row_idx, column=col_idx)
-                if cell.fill.start_color.index != '00000000':
-                    has_fill = True
-                    break
-            
-            if is_empty and not has_fill:
-                empty_rows.append(row_idx)
-        
-        # Разделение на цепочки (chains)
-        chain_ranges = []
-        start_row = 1
-        
-        for empty_row in empty_rows:
-            if empty_row > start_row:
-                chain_ranges.append((start_row, empty_row - 1))
-            start_row = empty_row + 1
-        
-        if start_row <= sheet.max_row:
-            chain_ranges.append((start_row, sheet.max_row))
-        
-        all_data = []
-        new_templates_created = []
-        
-        for chain_idx, (start_row, end_row) in enumerate(chain_ranges):
-            chain_height = end_row - start_row + 1
-            self.log_message(f"Processing chain {chain_idx+1}: rows {start_row} to {end_row} (высота: {chain_height})")
-            
-            # Определяем начальный столбец для блоков в зависимости от режима
-            first_block_start = 1 if has_uvnk else 2
-            
-            # Разбиваем цепочку на блоки по 8 столбцов
-            for col_start in range(first_block_start, sheet.max_column + 1, 8):
-                col_end = min(col_start + 7, sheet.max_column)
-                
-                # Проверяем, что в цепочке достаточно строк для групп
-                if chain_height < 9:  # Минимум 9 строк (3 сверху + 3 группа + 3 снизу)
-                    self.log_message(f"  Цепочка слишком короткая ({chain_height} строк), пропускаем")
-                    continue
-                
-                # Получаем дату из первой строки первого столбца блока
-                date_value = get_cell_value(start_row, col_start)
-                if not date_value:
-                    self.log_message(f"  Не найдена дата в ячейке ({start_row}, {col_start}), пропускаем блок")
-                    continue
-                
-                # Определяем начало и конец данных (пропускаем 3 строки сверху и 3 снизу)
-                data_start_row = start_row + 3  # Пропускаем 3 строки сверху
-                data_end_row = end_row - 3      # Пропускаем 3 строки снизу
-                
-                if data_start_row > data_end_row:
-                    self.log_message(f"  Нет места для данных (data_start_row={data_start_row} > data_end_row={data_end_row})")
-                    continue
-                
-                # Определяем печь
-                furnace_value = None
-                if has_uvnk:
-                    furnace_value = sheet_name
-                else:
-                    found_uppf = False
-                    
-                    # Ищем в первых трех строках блока
-                    for r in range(start_row, start_row + 3):
-                        for c in range(col_start, col_end + 1):
-                            cell_val = get_cell_value(r, c)
-                            if cell_val and "УППФ" in str(cell_val):
-                                furnace_value = cell_val
-                                found_uppf = True
-                                break
-                        if found_uppf:
-                            break
-                    
-                    if not found_uppf:
-                        furnace_value = ""
-                
-                # Определяем количество групп
-                available_rows = data_end_row - data_start_row + 1
-                num_groups = available_rows // 3
-                
-                if num_groups <= 0:
-                    self.log_message(f"  No groups available in block (available rows: {available_rows})")
-                    continue
-                
-                self.log_message(f"  Found {num_groups} groups in block")
-                
-                # Обрабатываем каждую группу в блоке
-                for group_idx in range(num_groups):
-                    group_start_row = data_start_row + group_idx * 3
-                    group_end_row = min(group_start_row + 2, data_end_row)
-                    
-                    # Проверяем, что группа полная (3 строки)
-                    if group_end_row - group_start_row < 2:
-                        continue
-                    
-                    # Анализируем структуру группы
-                    group_cells = self.analyze_group_structure(
-                        sheet, merged_ranges, group_start_row, col_start, col_end
-                    )
-                    
-                    # Если группа пустая (гигантская ячейка пропущена)
-                    if not group_cells:
-                        self.log_message(f"    Group {group_idx+1}: skipped (giant cell)")
-                        continue
-                    
-                    # Создаем cells для fingerprint (без значений)
-                    cells_for_fingerprint = []
-                    for cell in group_cells:
-                        cells_for_fingerprint.append({
-                            'row': cell['row'],
-                            'col': cell['col'],
-                            'rowspan': cell['rowspan'],
-                            'colspan': cell['colspan'],
-                            'required': cell['required']
-                        })
-                    
-                    # Генерируем fingerprint
-                    group_fingerprint = self.template_manager.generate_fingerprint(cells_for_fingerprint)
-                    
-                    # Ищем подходящий шаблон
-                    template = self.template_manager.find_template(sheet_name, group_fingerprint, has_uvnk)
-                    
-                    if template:
-                        # Используем существующий шаблон
-                        group_data = self.extract_data_with_template(group_cells, template)
-                        
-                        # Добавляем метаданные
-                        group_data['Date'] = date_value
-                        group_data['Furnace'] = furnace_value
-                        group_data['Group'] = group_idx + 1
-                        group_data['Block'] = chain_idx + 1
-                        group_data['Sheet'] = sheet_name
-                        group_data['Template'] = template['id']
-                        
-                        all_data.append(group_data)
-                        
-                        self.log_message(f"    Group {group_idx+1}: used template '{template['name']}'")
-                    
-                    elif self.auto_create_checkbox.isChecked():
-                        # Создаем новый шаблон
-                        new_template = self.template_manager.create_new_template(
-                            sheet_name, 
-                            group_cells,
-                            has_uvnk,
-                            f"Auto-created from sheet {sheet_name}, chain {chain_idx+1}, block starting col {col_start}"
-                        )
-                        
-                        new_templates_created.append(new_template['id'])
-                        
-                        self.log_message(f"    Group {group_idx+1}: created new template '{new_template['name']}'")
-                        
-                        # Если в шаблоне уже есть output_column, можно сразу использовать
-                        has_output_columns = any(cell.get('output_column', '') for cell in new_template['cells'])
-                        if has_output_columns:
-                            group_data = self.extract_data_with_template(group_cells, new_template)
-                            group_data['Date'] = date_value
-                            group_data['Furnace'] = furnace_value
-                            group_data['Group'] = group_idx + 1
-                            group_data['Block'] = chain_idx + 1
-                            group_data['Sheet'] = sheet_name
-                            group_data['Template'] = new_template['id']
-                            all_data.append(group_data)
-                    
-                    else:
-                        self.log_message(f"    Group {group_idx+1}: no template found and auto-create disabled")
-        
-        if new_templates_created:
-            self.log_message(f"Created {len(new_templates_created)} new templates")
-            # Предлагаем пользователю отредактировать новые шаблоны
-            QTimer.singleShot(100, self.prompt_template_edit)
-        
-        return all_data
     
     def prompt_template_edit(self):
         """Предлагает пользователю отредактировать новые шаблоны"""
@@ -758,92 +490,82 @@ class ExcelParserApp(QMainWindow):
                 self.edit_templates()
     
     def process_directory(self):
-        try:
-            directory = self.dir_path.text()
-            output_file = self.output_path.text()
-            
-            if not directory:
-                self.log_message("Please select a directory first.")
-                return
-            
-            # Сохраняем текущие настройки перед обработкой
-            self.save_settings()
-            
-            # Перезагружаем шаблоны
-            self.reload_templates()
-                
-            self.log_message("Scanning directory for Excel files...")
-            excel_files = glob.glob(os.path.join(directory, "**", "*.xlsx"), recursive=True)
-            excel_files.extend(glob.glob(os.path.join(directory, "**", "*.xls"), recursive=True))
-            
-            if not excel_files:
-                self.log_message("No Excel files found in the directory.")
-                return
-                
-            self.log_message(f"Found {len(excel_files)} Excel files.")
-            
-            all_data = []
-            total_files = len(excel_files)
-            
-            for file_idx, input_file in enumerate(excel_files):
-                self.progress.setValue(int(file_idx / total_files * 100))
-                self.log_message(f"Processing file {file_idx+1}/{total_files}: {os.path.basename(input_file)}")
-                
-                try:
-                    # ВСЕГДА используем data_only=True (игнорируем формулы)
-                    workbook = load_workbook(filename=input_file, data_only=True)
-                    
-                    for sheet_name in workbook.sheetnames:
-                        sheet_data = self.process_sheet(workbook, sheet_name)
-                        all_data.extend(sheet_data)
-                        self.log_message(f"  Extracted {len(sheet_data)} rows from {sheet_name}")
-                    
-                    workbook.close()
-                    
-                except Exception as e:
-                    self.log_message(f"Error processing file {input_file}: {str(e)}")
-                    import traceback
-                    self.log_message(traceback.format_exc())
-            
-            if all_data:
-                # Собираем все уникальные столбцы
-                all_columns = set()
-                for row in all_data:
-                    all_columns.update(row.keys())
-                
-                # Сортируем столбцы: сначала метаданные, затем остальные
-                base_columns = ['Date', 'Furnace', 'Group', 'Block', 'Sheet', 'Template']
-                other_columns = sorted([col for col in all_columns if col not in base_columns])
-                final_columns = base_columns + other_columns
-                
-                # Создаем DataFrame
-                df = pd.DataFrame(all_data)
-                
-                # Убеждаемся, что все столбцы существуют
-                for col in final_columns:
-                    if col not in df.columns:
-                        df[col] = None
-                
-                # Упорядочиваем столбцы
-                df = df[final_columns]
-                
-                # Сохраняем в Excel
-                df.to_excel(output_file, index=False)
-                self.log_message(f"Data successfully saved to {output_file}")
-                self.log_message(f"Total rows: {len(all_data)}")
-                self.log_message(f"Total columns: {len(final_columns)}")
-                self.log_message(f"Total templates in library: {len(self.template_manager.templates)}")
-                
-            else:
-                self.log_message("No data was extracted.")
-                
-            self.progress.setValue(100)
-            
-        except Exception as e:
-            self.log_message(f"Error: {str(e)}")
-            import traceback
-            self.log_message(traceback.format_exc())
-            self.progress.setValue(0)
+        # Повторный запуск во время обработки игнорируем
+        if self.worker_thread is not None:
+            return
+        
+        directory = self.dir_path.text()
+        output_file = self.output_path.text()
+        
+        if not directory:
+            self.log_message("Please select a directory first.")
+            return
+        
+        # Сохраняем текущие настройки перед обработкой
+        self.save_settings()
+        
+        profile_file = None
+        if self.save_profile_checkbox.isChecked():
+            profile_file = os.path.splitext(output_file)[0] + ".profile.json"
+        
+        # Перезагружаем шаблоны
+        self.reload_templates()
+        
+        # Обработка идет в отдельном потоке, интерфейс получает сигналы
+        self.worker = ProcessingWorker(
+            self.template_manager,
+            directory,
+            output_file,
+            self.auto_create_checkbox.isChecked(),
+            self.workers_spin.value(),
+            self.use_cache_checkbox.isChecked(),
+            self.timeout_spin.value() or None,
+            self.dedup_combo.currentData(),
+            profile_file
+        )
+        self.worker_thread = QThread()
+        self.worker.moveToThread(self.worker_thread)
+        
+        self.worker_thread.started.connect(self.worker.run)
+        self.worker.log_message.connect(self.log_message)
+        self.worker.progress.connect(self.progress.setValue)
+        self.worker.file_finished.connect(self.on_file_finished)
+        self.worker.finished.connect(self.on_processing_finished)
+        # quit() потокобезопасен; прямое соединение не требует цикла событий интерфейса
+        self.worker.finished.connect(self.worker_thread.quit, Qt.DirectConnection)
+        self.worker_thread.finished.connect(self.on_thread_finished)
+        
+        self.set_controls_enabled(False)
+        self.status_label.setText("Processing...")
+        self.worker_thread.start()
+    
+    def cancel_processing(self):
+        """Запрашивает остановку обработки после текущего файла"""
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancel_btn.setEnabled(False)
+            self.status_label.setText("Cancelling...")
+    
+    def on_file_finished(self, input_file, rows, ok):
+        name = os.path.basename(input_file)
+        if ok:
+            self.status_label.setText(f"{name}: {rows} rows")
+        else:
+            self.status_label.setText(f"{name}: error")
+    
+    def on_processing_finished(self, new_templates_created):
+        self.set_controls_enabled(True)
+        self.status_label.setText("Cancelled" if self.worker.is_cancelled() else "Done")
+        
+        if new_templates_created:
+            # Предлагаем пользователю отредактировать новые шаблоны
+            QTimer.singleShot(100, self.prompt_template_edit)
+    
+    def on_thread_finished(self):
+        self.worker_thread.deleteLater()
+        self.worker.deleteLater()
+        self.worker_thread = None
+        self.worker = None
 
 def main():
     app = QApplication(sys.argv)
@@ -852,4 +574,4 @@ def main():
     sys.exit(app.exec_())
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,321 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import Counter
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import PatternFill
+from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+from greenTableTemplates import TemplateManager
+from greenTableEngine import ExcelProcessor, SheetSnapshot, process_files
+from greenTableReader import open_workbook
+from greenTableOutput import open_sink
+
+# Масштабы: файлов, цепочек на лист, блоков на цепочку, групп на цепочку
+SCALES = {
+    'small': {'files': 1, 'chains': 10, 'blocks': 3, 'groups': 6},
+    'medium': {'files': 4, 'chains': 40, 'blocks': 4, 'groups': 8},
+    'large': {'files': 4, 'chains': 100, 'blocks': 6, 'groups': 10},
+}
+
+# Листы с УВНК (блоки с 1-го столбца) и с УППФ в шапке блока (блоки со 2-го)
+SHEET_NAMES = ['498(УВНК-9А№2)', '522', '9002 УППФ']
+
+# Структуры групп с объединениями: (row, col, rowspan, colspan)
+MERGED_LAYOUTS = [
+    [(0, 0, 3, 1), (0, 1, 3, 1), (0, 2, 1, 3), (0, 5, 1, 3), (1, 2, 1, 3), (1, 5, 2, 3), (2, 2, 1, 3)],
+    [(0, 0, 3, 1), (0, 1, 3, 1), (0, 2, 1, 3), (0, 5, 1, 3), (1, 2, 1, 3), (1, 5, 1, 3), (2, 2, 1, 3), (2, 5, 1, 3)],
+]
+
+SAMPLE_VALUES = [30, 1184, 1.5, '25-Н-4003', 'Ш-12', 7]
+
+STAGES = ['load', 'segmentation', 'group_analysis', 'matching', 'extraction', 'export']
+
+def quiet(message):
+    pass
+
+def generate_workbook(path, seed, chains, blocks, groups, merge_density=0.7, giant_rate=0.05,
+                      sheet_names=SHEET_NAMES):
+    """Создает книгу в формате журналов: цепочки через пустые строки, блоки по 8 столбцов,
+    группы по 3 строки, 3 строки шапки и 3 строки подвала на цепочку.
+
+    merge_density - доля групп с объединенными ячейками, giant_rate - доля групп,
+    целиком закрытых одной ячейкой
+    """
+    rnd = random.Random(seed)
+    # Книга пишется построчно: merge_cells полной книги замедляется с числом объединений
+    workbook = Workbook(write_only=True)
+    separator_fill = PatternFill('solid', start_color='C0C0C0')
+
+    for sheet_name in sheet_names:
+        sheet = workbook.create_sheet(sheet_name)
+        first_block_start = 1 if 'увнк' in sheet_name.lower() else 2
+        values = {}
+        filled = set()
+        merges = []
+
+        def merge(min_row, min_col, max_row, max_col):
+            merges.append(CellRange(min_row=min_row, min_col=min_col, max_row=max_row, max_col=max_col))
+
+        row = 1
+        for chain in range(chains):
+            for block in range(blocks):
+                col_start = first_block_start + block * 8
+                # Шапка: дата, печь (на листах без УВНК - с УППФ), подписи столбцов
+                values[row, col_start] = f"{chain % 28 + 1:02d}.01.2024"
+                values[row + 1, col_start + 2] = f"УППФ-{block + 1}" if first_block_start == 2 else "Смена 1"
+                values[row + 2, col_start] = "Керамика"
+
+                for group in range(groups):
+                    group_row = row + 3 + group * 3
+                    kind = rnd.random()
+                    if kind < giant_rate:
+                        merge(group_row, col_start, group_row + 2, col_start + 7)
+                        values[group_row, col_start] = "нет данных"
+                    elif kind < giant_rate + merge_density:
+                        for r, c, rowspan, colspan in rnd.choice(MERGED_LAYOUTS):
+                            if rowspan > 1 or colspan > 1:
+                                merge(group_row + r, col_start + c,
+                                      group_row + r + rowspan - 1, col_start + c + colspan - 1)
+                            if rnd.random() < 0.9:
+                                values[group_row + r, col_start + c] = rnd.choice(SAMPLE_VALUES)
+                    else:
+                        for r in range(3):
+                            # Первый столбец заполнен всегда, иначе строка стала бы разделителем
+                            for c in range(8):
+                                if c == 0 or rnd.random() < 0.3:
+                                    values[group_row + r, col_start + c] = rnd.randint(1, 99)
+
+                # Подвал цепочки
+                for r, caption in enumerate(["Подписи", "Мастер", "Итого"]):
+                    values[row + 3 + groups * 3 + r, col_start] = caption
+
+            row += 3 + groups * 3 + 3
+            # Разделитель - пустая строка; иногда перед ней залитая строка без данных
+            if rnd.random() < 0.3:
+                filled.add((row, 4))
+                row += 1
+            row += 1
+
+        max_col = first_block_start + blocks * 8 - 1
+        for r in range(1, row):
+            cells = []
+            for c in range(1, max_col + 1):
+                if (r, c) in filled:
+                    cell = WriteOnlyCell(sheet)
+                    cell.fill = separator_fill
+                    cells.append(cell)
+                else:
+                    cells.append(values.get((r, c)))
+            sheet.append(cells)
+        sheet.merged_cells = MultiCellRange(merges)
+
+    workbook.save(path)
+
+def generate_files(workdir, scale_name, params, seed=0):
+    """Создает (или берет уже созданные) файлы масштаба в workdir"""
+    files = []
+    for i in range(params['files']):
+        path = os.path.join(workdir, f"{scale_name}_{i}.xlsx")
+        if not os.path.exists(path):
+            generate_workbook(path, seed + i, params['chains'], params['blocks'], params['groups'],
+                              params.get('merge_density', 0.7), params.get('giant_rate', 0.05))
+        files.append(path)
+    return files
+
+def prepare_library(files):
+    """Библиотека, в которой есть шаблон для каждой группы, с заполненными output_column"""
+    template_manager = TemplateManager(templates=[])
+    processor = ExcelProcessor(template_manager, auto_create=True, log=quiet)
+    for input_file in files:
+        processor.process_file(input_file)
+    for template in template_manager.templates:
+        for cell in template['cells']:
+            cell['output_column'] = f"Поле {cell['row']}_{cell['col']}"
+    template_manager.rebuild_index()
+    return template_manager
+
+def run_stages(files, template_manager, workdir):
+    """Замеряет этапы разбора по отдельности; возвращает (время по этапам, счетчики)"""
+    timings = dict.fromkeys(STAGES, 0.0)
+    counts = Counter()
+    processor = ExcelProcessor(template_manager, auto_create=False, log=quiet)
+    rows = []
+
+    for input_file in files:
+        counts['files'] += 1
+        start = time.perf_counter()
+        workbook = open_workbook(input_file, quiet)
+        sheets = [(sheet_name, workbook[sheet_name]) for sheet_name in workbook.sheetnames]
+        workbook.close()
+        timings['load'] += time.perf_counter() - start
+
+        for sheet_name, sheet in sheets:
+            counts['sheets'] += 1
+            has_uvnk = 'увнк' in sheet_name.lower()
+            start = time.perf_counter()
+            snapshot = SheetSnapshot(sheet)
+            chains = snapshot.segment_chains()
+            timings['segmentation'] += time.perf_counter() - start
+            counts['chains'] += len(chains)
+
+            processor.group_skeletons = {}
+            for start_row, end_row, group_starts in chains:
+                if end_row - start_row + 1 < 9:
+                    continue
+                for col_start in range(1 if has_uvnk else 2, snapshot.max_col + 1, 8):
+                    col_end = min(col_start + 7, snapshot.max_col)
+                    if not snapshot.value(start_row, col_start):
+                        continue
+                    for group_start_row in group_starts:
+                        counts['groups'] += 1
+                        start = time.perf_counter()
+                        group_cells, fingerprint = processor.build_group(snapshot, group_start_row, col_start, col_end)
+                        timings['group_analysis'] += time.perf_counter() - start
+                        if not group_cells:
+                            counts['giant_groups'] += 1
+                            continue
+
+                        start = time.perf_counter()
+                        template = template_manager.find_template(sheet_name, fingerprint, has_uvnk)
+                        timings['matching'] += time.perf_counter() - start
+                        if template is None:
+                            counts['unmatched'] += 1
+                            continue
+
+                        start = time.perf_counter()
+                        rows.append(processor.extract_data_with_template(group_cells, template))
+                        timings['extraction'] += time.perf_counter() - start
+
+    counts['rows'] = len(rows)
+    start = time.perf_counter()
+    sink = open_sink(os.path.join(workdir, "bench_output.xlsx"))
+    sink.write_rows(rows)
+    sink.close()
+    timings['export'] += time.perf_counter() - start
+    return timings, counts
+
+def run_end_to_end(files, template_manager, workdir, workers):
+    """Время process_files целиком (без кеша) с записью результата"""
+    library = TemplateManager(templates=[dict(t) for t in template_manager.templates])
+    sink = open_sink(os.path.join(workdir, "bench_output.xlsx"))
+    start = time.perf_counter()
+    process_files(files, library, auto_create=False, workers=workers, log=quiet, sink=sink)
+    sink.close()
+    return time.perf_counter() - start
+
+def run_benchmark(scale_names, workdir, repeat=3, workers=1):
+    results = []
+    for scale_name in scale_names:
+        params = SCALES[scale_name]
+        print(f"Scale {scale_name}: preparing files...", file=sys.stderr)
+        files = generate_files(workdir, scale_name, params)
+        template_manager = prepare_library(files)
+
+        # Лучшее из нескольких повторов меньше зависит от фоновой нагрузки
+        best = None
+        for _ in range(repeat):
+            timings, counts = run_stages(files, template_manager, workdir)
+            if best is None:
+                best = timings
+            else:
+                best = {stage: min(best[stage], timings[stage]) for stage in STAGES}
+        end_to_end = min(run_end_to_end(files, template_manager, workdir, workers) for _ in range(repeat))
+
+        result = {
+            'scale': scale_name,
+            'params': params,
+            'counts': dict(counts),
+            'templates': len(template_manager.templates),
+            'stages': {stage: round(best[stage], 6) for stage in STAGES},
+            'end_to_end': round(end_to_end, 6),
+            'groups_per_second': round(counts['groups'] / end_to_end, 1) if end_to_end else None,
+        }
+        results.append(result)
+        print(f"Scale {scale_name}: {counts['groups']} groups, end to end {end_to_end:.3f}s", file=sys.stderr)
+    return results
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+def compare(results, baseline, threshold):
+    """Печатает отношение времени к базовому замеру; возвращает True, если есть замедления"""
+    regressions = False
+    baseline_by_scale = {r['scale']: r for r in baseline.get('results', [])}
+    for result in results:
+        old = baseline_by_scale.get(result['scale'])
+        if old is None:
+            continue
+        pairs = [(stage, result['stages'][stage], old['stages'].get(stage)) for stage in STAGES]
+        pairs.append(('end_to_end', result['end_to_end'], old.get('end_to_end')))
+        for stage, new_time, old_time in pairs:
+            if not old_time:
+                continue
+            ratio = new_time / old_time
+            mark = ''
+            if ratio > threshold:
+                mark = '  REGRESSION'
+                regressions = True
+            print(f"{result['scale']:>8} {stage:>15}: {old_time:.4f}s -> {new_time:.4f}s (x{ratio:.2f}){mark}",
+                  file=sys.stderr)
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры скорости разбора на синтетических журналах")
+    parser.add_argument("--scales", default="small,medium,large",
+                        help=f"Масштабы через запятую: {', '.join(SCALES)}")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="Файл результатов JSON")
+    parser.add_argument("--workdir", help="Директория для сгенерированных книг (повторно используется)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Повторов на масштаб (берется лучший)")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="Процессов для замера process_files")
+    parser.add_argument("--compare", help="Результаты предыдущей версии для сравнения")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Замедление, считающееся регрессией (по умолчанию 1.25)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    scale_names = [s.strip() for s in args.scales.split(',') if s.strip()]
+    unknown = [s for s in scale_names if s not in SCALES]
+    if unknown:
+        print(f"Unknown scales: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="greentable_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    results = run_benchmark(scale_names, workdir, args.repeat, args.workers)
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'workers': args.workers,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results saved to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,309 @@
+import sys
+import os
+import json
+import time
+import pickle
+import hashlib
+from collections import Counter
+from greenTableReader import sheet_keys
+
+CACHE_VERSION = 2
+
+def file_content_hash(path):
+    """SHA-1 содержимого файла"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def template_signature(template_manager, template):
+    """Хеш того, что влияет на строки шаблона: id и план извлечения"""
+    plan = template_manager.get_extraction_plan(template)
+    data = json.dumps([template['id'], plan], ensure_ascii=False)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+
+def library_hash(template_manager):
+    """Хеш всей библиотеки: порядок, ключи сопоставления и планы извлечения"""
+    digest = hashlib.sha1()
+    for template in template_manager.templates:
+        data = json.dumps([
+            template['sheet'],
+            template['fingerprint'],
+            template.get('has_uvnk', False),
+            template_signature(template_manager, template)
+        ], ensure_ascii=False)
+        digest.update(data.encode('utf-8'))
+    return digest.hexdigest()
+
+class ResultCache:
+    """Кеш извлеченных строк по файлам.
+
+    Манифест хранит для каждого файла размер, mtime, хеш содержимого и результаты
+    поиска шаблонов (лист, fingerprint, увнк -> id и подпись шаблона). Файл берется
+    из кеша, только если он не менялся и библиотека находит для его групп те же шаблоны.
+    """
+    def __init__(self, cache_dir=".greentable_cache"):
+        self.cache_dir = cache_dir
+        self.manifest_file = os.path.join(cache_dir, "manifest.json")
+        self.entries = {}
+        # Хеши содержимого для поиска повторов (greenTableDedup): ключ файла ->
+        # {'size', 'mtime_ns', 'hash', 'sheets' - ключи листов}, пересчитываются при смене размера или mtime
+        self.content = {}
+        self.template_manager = None
+        self.auto_create = True
+        self.library_hash = None
+        self.load()
+
+    def load(self):
+        try:
+            if os.path.exists(self.manifest_file):
+                with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == CACHE_VERSION:
+                    self.entries = data.get('files', {})
+                    self.content = data.get('content', {})
+        except Exception as e:
+            print(f"Error loading result cache: {e}", file=sys.stderr)
+            self.entries = {}
+            self.content = {}
+
+    def save(self):
+        """Атомарно сохраняет манифест; записи удаленных файлов отбрасываются"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for path in [p for p in self.entries if not os.path.exists(p)]:
+                self.remove(path)
+            for path in [p for p in self.content if not os.path.exists(p)]:
+                del self.content[path]
+            tmp_file = self.manifest_file + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'version': CACHE_VERSION, 'files': self.entries, 'content': self.content},
+                          f, ensure_ascii=False)
+            os.replace(tmp_file, self.manifest_file)
+            return True
+        except Exception as e:
+            print(f"Error saving result cache: {e}", file=sys.stderr)
+            return False
+
+    def begin_run(self, template_manager, auto_create):
+        """Запоминает состояние библиотеки для проверки записей в этом запуске"""
+        self.template_manager = template_manager
+        self.auto_create = auto_create
+        self.library_hash = library_hash(template_manager)
+
+    @staticmethod
+    def cache_key(input_file):
+        return os.path.normcase(os.path.abspath(input_file))
+
+    def rows_file(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest() + ".pkl"
+        return os.path.join(self.cache_dir, name)
+
+    def content_entry(self, input_file):
+        """Хеши содержимого файла; запись сбрасывается, если размер или mtime изменились"""
+        key = self.cache_key(input_file)
+        stat = os.stat(input_file)
+        entry = self.content.get(key)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            # Хеш из записи строк файла годится, если файл с тех пор не трогали
+            cached = self.entries.get(key)
+            if cached is not None and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+                entry['hash'] = cached['hash']
+            self.content[key] = entry
+        return entry
+
+    def content_hash(self, input_file):
+        """SHA-1 содержимого файла без повторного чтения неизмененного файла"""
+        entry = self.content_entry(input_file)
+        if 'hash' not in entry:
+            entry['hash'] = file_content_hash(input_file)
+        return entry['hash']
+
+    def sheet_keys(self, input_file):
+        """Ключи листов файла (greenTableReader.sheet_keys) без повторного чтения неизмененного файла"""
+        entry = self.content_entry(input_file)
+        if 'sheets' not in entry:
+            entry['sheets'] = sheet_keys(input_file)
+        return [tuple(item) for item in entry['sheets']]
+
+    def lookups_valid(self, entry):
+        """Проверяет, что библиотека находит для групп файла те же шаблоны"""
+        for sheet_name, fingerprint, has_uvnk, template_id, signature in entry['lookups']:
+            if template_id is None and self.auto_create:
+                # Повторный разбор создал бы для группы новый шаблон
+                return False
+            if entry['library_hash'] == self.library_hash:
+                continue
+            template = self.template_manager.find_template(sheet_name, fingerprint, has_uvnk)
+            if template is None:
+                if template_id is not None:
+                    return False
+            elif (template['id'] != template_id or
+                  template_signature(self.template_manager, template) != signature):
+                return False
+        return True
+
+    def get(self, input_file):
+        """Возвращает (строки, счетчики) файла из кеша или None, если файл нужно разобрать заново"""
+        key = self.cache_key(input_file)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        try:
+            stat = os.stat(input_file)
+            if stat.st_size != entry['size']:
+                return None
+            if stat.st_mtime_ns != entry['mtime_ns']:
+                # Файл тронут, но мог не измениться - сверяем содержимое
+                if file_content_hash(input_file) != entry['hash']:
+                    return None
+                entry['mtime_ns'] = stat.st_mtime_ns
+
+            if not self.lookups_valid(entry):
+                return None
+
+            rows = self.load_rows(key)
+        except Exception:
+            return None
+
+        entry['library_hash'] = self.library_hash
+        return rows, Counter(entry.get('stats', {}))
+
+    def previous(self, input_file):
+        """(строки, счетчики) последнего разбора файла без проверки, что он не менялся, или None"""
+        key = self.cache_key(input_file)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        try:
+            return self.load_rows(key), Counter(entry.get('stats', {}))
+        except Exception:
+            return None
+
+    def load_rows(self, key):
+        with open(self.rows_file(key), 'rb') as f:
+            columns, values = pickle.load(f)
+        return [dict(zip(columns, row)) for row in values]
+
+    def put(self, input_file, rows, lookups, file_stats=None):
+        """Сохраняет строки файла, результаты поиска шаблонов (ключ -> id или None) и счетчики"""
+        key = self.cache_key(input_file)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+            # Строки храним столбцами: имена один раз, значения кортежами
+            # (отсутствующий столбец становится None - в выходном файле это та же пустая ячейка)
+            columns = []
+            seen = set()
+            for row in rows:
+                for column in row:
+                    if column not in seen:
+                        seen.add(column)
+                        columns.append(column)
+            values = [tuple(row.get(column) for column in columns) for row in rows]
+            with open(self.rows_file(key), 'wb') as f:
+                pickle.dump((columns, values), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            stored_lookups = []
+            templates_by_id = {t['id']: t for t in self.template_manager.templates}
+            for (sheet_name, fingerprint, has_uvnk), template_id in lookups.items():
+                signature = None
+                if template_id in templates_by_id:
+                    signature = template_signature(self.template_manager, templates_by_id[template_id])
+                stored_lookups.append([sheet_name, fingerprint, has_uvnk, template_id, signature])
+
+            stat = os.stat(input_file)
+            self.entries[key] = {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'hash': file_content_hash(input_file),
+                'library_hash': self.library_hash,
+                'lookups': stored_lookups,
+                'stats': dict(file_stats or {}),
+            }
+        except Exception as e:
+            print(f"Error caching results for {input_file}: {e}", file=sys.stderr)
+            self.entries.pop(key, None)
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+        try:
+            os.remove(self.rows_file(key))
+        except OSError:
+            pass
+
+class Quarantine:
+    """Файлы, разбор которых прерван по времени или памяти.
+
+    Такой файл пропускается в следующих запусках, пока не изменится
+    (размер, mtime и, при смене mtime, хеш содержимого)
+    """
+    def __init__(self, cache_dir=".greentable_cache"):
+        self.cache_dir = cache_dir
+        self.quarantine_file = os.path.join(cache_dir, "quarantine.json")
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            if os.path.exists(self.quarantine_file):
+                with open(self.quarantine_file, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f).get('files', {})
+        except Exception as e:
+            print(f"Error loading quarantine list: {e}", file=sys.stderr)
+            self.entries = {}
+
+    def save(self):
+        """Атомарно сохраняет список; записи удаленных файлов отбрасываются"""
+        if not self.entries and not os.path.exists(self.quarantine_file):
+            return True
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for path in [p for p in self.entries if not os.path.exists(p)]:
+                del self.entries[path]
+            tmp_file = self.quarantine_file + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'files': self.entries}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.quarantine_file)
+            return True
+        except Exception as e:
+            print(f"Error saving quarantine list: {e}", file=sys.stderr)
+            return False
+
+    def get(self, input_file):
+        """Причина карантина или None, если файла в карантине нет или он изменился"""
+        key = ResultCache.cache_key(input_file)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(input_file)
+            unchanged = stat.st_size == entry['size'] and (
+                stat.st_mtime_ns == entry['mtime_ns'] or file_content_hash(input_file) == entry['hash']
+            )
+        except OSError:
+            unchanged = False
+        if not unchanged:
+            del self.entries[key]
+            return None
+        return entry['reason']
+
+    def add(self, input_file, reason):
+        key = ResultCache.cache_key(input_file)
+        try:
+            stat = os.stat(input_file)
+            self.entries[key] = {
+                'reason': reason,
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'hash': file_content_hash(input_file),
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            }
+        except OSError as e:
+            print(f"Error quarantining {input_file}: {e}", file=sys.stderr)
+
+    def clear(self):
+        self.entries = {}
@@ -0,0 +1,185 @@
+import sys
+import os
+import json
+import time
+import argparse
+import traceback
+from collections import Counter
+from greenTableTemplates import TemplateManager
+from greenTableEngine import process_files, find_excel_files
+from greenTableOutput import open_sink, close_sink
+from greenTableCache import ResultCache, Quarantine
+from greenTableProfile import RunProfile
+from greenTableDedup import DEDUP_MODES
+from greenTableTelemetry import MatchTelemetry
+
+# Коды завершения
+EXIT_OK = 0             # Все файлы обработаны
+EXIT_FILE_ERRORS = 1    # Часть файлов не удалось обработать
+EXIT_FAILURE = 2        # Обработка не выполнена (нет директории, файлов или ошибка записи)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Пакетная обработка журналов Excel по библиотеке шаблонов без интерфейса"
+    )
+    parser.add_argument("directory", help="Директория с файлами Excel (обходится рекурсивно)")
+    parser.add_argument("-o", "--output", default="output.xlsx", help="Выходной файл: .xlsx, .csv или база .sqlite/.db (по умолчанию output.xlsx)")
+    parser.add_argument("-t", "--templates", default="templates.json", help="Файл библиотеки шаблонов")
+    parser.add_argument("--auto-create", dest="auto_create", action="store_true", default=True,
+                        help="Создавать шаблоны для неизвестных структур (по умолчанию)")
+    parser.add_argument("--no-auto-create", dest="auto_create", action="store_false",
+                        help="Не создавать новые шаблоны")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="Количество процессов (по умолчанию по числу ядер)")
+    parser.add_argument("--cache-dir", default=".greentable_cache",
+                        help="Директория кеша результатов по файлам")
+    parser.add_argument("--no-cache", action="store_true", help="Разбирать все файлы заново")
+    parser.add_argument("--dedup", choices=DEDUP_MODES, default=None,
+                        help="Разбирать одинаковые файлы и листы один раз: first - оставить первое вхождение, "
+                             "tag - еще и перечислить все пути в столбце Sources")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Предел времени на файл, секунд (файл разбирается в отдельном процессе)")
+    parser.add_argument("--memory-limit", type=int, default=None,
+                        help="Предел памяти процесса разбора файла, МБ (только где есть модуль resource)")
+    parser.add_argument("--retry-quarantined", action="store_true",
+                        help="Разобрать заново файлы из карантина (прерванные по времени или памяти)")
+    parser.add_argument("--match-report", metavar="REPORT",
+                        help="Сохранить сводку совпадений шаблонов (.json): строки по шаблонам и "
+                             "fingerprint без шаблона с местами групп")
+    parser.add_argument("--profile", metavar="REPORT",
+                        help="Сохранить время этапов и счетчики по файлам и листам (.json или .csv)")
+    parser.add_argument("--cprofile", metavar="FILE",
+                        help="Снять cProfile разбора одного файла (путь или имя файла)")
+    parser.add_argument("--cprofile-output", default="greentable.prof",
+                        help="Файл статистики cProfile (по умолчанию greentable.prof)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Не выводить лог обработки")
+    return parser.parse_args(argv)
+
+def run(args):
+    """Выполняет обработку и возвращает (код завершения, сводка)"""
+    start_time = time.time()
+    stats = Counter()
+    summary = {
+        'directory': args.directory,
+        'output': args.output,
+        'templates': args.templates,
+    }
+
+    # Лог идет в stderr, чтобы stdout содержал только сводку JSON
+    if args.quiet:
+        def log(message):
+            pass
+    else:
+        def log(message):
+            print(message, file=sys.stderr)
+
+    def finish(status, error=None):
+        summary.update({
+            'status': status,
+            'error': error,
+            'files': stats['files'],
+            'cached_files': stats['cached_files'],
+            'failed_files': stats['failed_files'],
+            'sheets': stats['sheets'],
+            'groups': stats['groups'],
+            'matched': stats['matched'],
+            'unmatched': stats['unmatched'],
+            'giant_groups': stats['giant_groups'],
+            'quarantined_files': stats['quarantined_files'],
+            'duplicate_files': stats['duplicate_files'],
+            'duplicate_sheets': stats['duplicate_sheets'],
+            'new_templates': summary.get('new_templates', 0),
+            'rows': stats['rows'],
+            'elapsed': round(time.time() - start_time, 3),
+        })
+        return status, summary
+
+    if not os.path.isdir(args.directory):
+        return finish(EXIT_FAILURE, f"Directory not found: {args.directory}")
+
+    template_manager = TemplateManager(args.templates)
+    if template_manager.load_error is not None:
+        # С пустой библиотекой разбор создал бы шаблоны заново
+        return finish(EXIT_FAILURE, f"Error loading {args.templates}: {template_manager.load_error}")
+    log(f"Loaded {len(template_manager.templates)} templates from {args.templates}")
+
+    excel_files = find_excel_files(args.directory)
+    if not excel_files:
+        return finish(EXIT_FAILURE, "No Excel files found in the directory.")
+    log(f"Found {len(excel_files)} Excel files.")
+
+    try:
+        sink = open_sink(args.output)
+    except Exception as e:
+        return finish(EXIT_FAILURE, f"Error opening {args.output}: {str(e)}")
+
+    # Карантин хранится рядом с кешем и действует и без кеша
+    quarantine = Quarantine(args.cache_dir)
+    if args.retry_quarantined:
+        quarantine.clear()
+    # Совпадения шаблонов по файлам копятся между запусками там же
+    telemetry = MatchTelemetry(args.cache_dir)
+
+    profile = None
+    if args.profile or args.cprofile:
+        profile = RunProfile(args.cprofile, args.cprofile_output)
+
+    try:
+        _, new_templates_created = process_files(
+            excel_files,
+            template_manager,
+            auto_create=args.auto_create,
+            workers=args.workers,
+            log=log,
+            stats=stats,
+            cache=None if args.no_cache else ResultCache(args.cache_dir),
+            sink=sink,
+            profile=profile,
+            timeout=args.timeout,
+            memory_limit=args.memory_limit,
+            quarantine=quarantine,
+            dedup=args.dedup,
+            telemetry=telemetry
+        )
+    except Exception as e:
+        # Например, BrokenProcessPool, если рабочий процесс убит без --timeout:
+        # выходной файл не трогаем, сводка все равно выводится
+        log(traceback.format_exc())
+        sink.abort()
+        template_manager.flush()
+        return finish(EXIT_FAILURE, f"Error processing files: {str(e)}")
+    summary['new_templates'] = len(new_templates_created)
+
+    try:
+        close_sink(sink, template_manager, log, profile)
+    except Exception as e:
+        return finish(EXIT_FAILURE, f"Error saving {args.output}: {str(e)}")
+    finally:
+        template_manager.flush()
+
+    if args.match_report:
+        try:
+            telemetry.save_report(args.match_report, template_manager)
+            log(f"Match report saved to {args.match_report}")
+        except Exception as e:
+            return finish(EXIT_FAILURE, f"Error saving {args.match_report}: {str(e)}")
+
+    if args.profile:
+        try:
+            profile.save(args.profile)
+            log(f"Profile saved to {args.profile}")
+        except Exception as e:
+            return finish(EXIT_FAILURE, f"Error saving {args.profile}: {str(e)}")
+
+    if stats['failed_files']:
+        return finish(EXIT_FILE_ERRORS, f"{stats['failed_files']} files failed")
+    return finish(EXIT_OK)
+
+def main(argv=None):
+    args = parse_args(argv)
+    status, summary = run(args)
+    print(json.dumps(summary, ensure_ascii=False))
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
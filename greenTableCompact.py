@@ -0,0 +1,38 @@
+import sys
+import json
+import copy
+import argparse
+from greenTableTemplates import TemplateManager
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Сжатие библиотеки шаблонов: слияние дубликатов, вынос примеров, отчет о перекрытых шаблонах"
+    )
+    parser.add_argument("-t", "--templates", default="templates.json", help="Файл библиотеки шаблонов")
+    parser.add_argument("--keep-examples", action="store_true",
+                        help="Оставить примеры ячеек в файле шаблонов")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="Только вывести отчет, ничего не записывать")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    template_manager = TemplateManager(args.templates)
+    templates_before = len(template_manager.templates)
+
+    if args.dry_run:
+        # Библиотека в памяти: compact() ничего не запишет на диск
+        template_manager = TemplateManager(templates=copy.deepcopy(template_manager.templates))
+
+    report = template_manager.compact(move_examples=not args.keep_examples)
+    report.update({
+        'templates': args.templates,
+        'dry_run': args.dry_run,
+        'templates_before': templates_before,
+        'templates_after': len(template_manager.templates),
+    })
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
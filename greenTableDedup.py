@@ -0,0 +1,90 @@
+from greenTableCache import file_content_hash
+from greenTableReader import sheet_keys, is_biff_file
+
+# Что делать с повторами: оставить первое вхождение или еще и отметить все пути источника
+DEDUP_MODES = ('first', 'tag')
+
+class DuplicateIndex:
+    """Одинаковые файлы и листы среди файлов запуска (предварительный проход)"""
+    def __init__(self):
+        self.duplicate_files = {}   # путь -> первый файл с тем же содержимым
+        self.file_sources = {}      # первый файл -> все пути с тем же содержимым
+        self.sheet_names = {}       # путь -> листы книги по порядку (только .xlsx)
+        self.duplicate_sheets = {}  # (путь, лист) -> (первый файл, лист) с тем же содержимым
+        self.sheet_sources = {}     # (первый файл, лист) -> все пути, где есть такой лист
+
+    def skipped_sheets(self, input_file):
+        """Листы файла, которые уже есть в более раннем файле"""
+        return [
+            sheet_name for sheet_name in self.sheet_names.get(input_file, [])
+            if (input_file, sheet_name) in self.duplicate_sheets
+        ]
+
+    def sheets_to_parse(self, input_file):
+        """Листы файла без повторов или None, если разбирать нужно все"""
+        skipped = self.skipped_sheets(input_file)
+        if not skipped:
+            return None
+        return [sheet_name for sheet_name in self.sheet_names[input_file] if sheet_name not in skipped]
+
+    def sources(self, input_file, sheet_name):
+        """Все пути, где встречается содержимое листа"""
+        return self.sheet_sources.get((input_file, sheet_name)) or self.file_sources.get(input_file, [input_file])
+
+def find_duplicates(excel_files, log=print, cache=None):
+    """Хеширует файлы и листы .xlsx и находит повторы; первое вхождение - в порядке excel_files.
+
+    С cache (greenTableCache.ResultCache) хеши неизмененных файлов берутся из него
+    """
+    index = DuplicateIndex()
+
+    keys_by_file = {}
+
+    def file_sheet_keys(input_file):
+        if input_file not in keys_by_file:
+            try:
+                keys = cache.sheet_keys(input_file) if cache is not None else sheet_keys(input_file)
+            except OSError:
+                keys = []
+            keys_by_file[input_file] = keys
+        return keys_by_file[input_file]
+
+    def readable(input_file):
+        """Книга, которую прочтет разбор: .xlsx с листами или .xls"""
+        return bool(file_sheet_keys(input_file)) or is_biff_file(input_file)
+
+    unreadable = set()
+    first_by_hash = {}
+    for input_file in excel_files:
+        try:
+            content_hash = cache.content_hash(input_file) if cache is not None else file_content_hash(input_file)
+        except OSError:
+            # Ошибку чтения сообщит разбор
+            index.file_sources[input_file] = [input_file]
+            unreadable.add(input_file)
+            continue
+        first = first_by_hash.setdefault(content_hash, input_file)
+        if first != input_file and readable(first):
+            index.duplicate_files[input_file] = first
+            index.file_sources[first].append(input_file)
+        else:
+            # Копии нечитаемого файла разбираются каждая и каждая дает свою ошибку
+            index.file_sources[input_file] = [input_file]
+
+    first_by_key = {}
+    for input_file in excel_files:
+        if input_file in index.duplicate_files or input_file in unreadable:
+            continue
+        keys = file_sheet_keys(input_file)
+        if keys:
+            index.sheet_names[input_file] = [sheet_name for sheet_name, _ in keys]
+        for sheet_name, key in keys:
+            first = first_by_key.setdefault(key, (input_file, sheet_name))
+            if first != (input_file, sheet_name):
+                index.duplicate_sheets[input_file, sheet_name] = first
+            index.sheet_sources.setdefault(first, []).extend(index.file_sources[input_file])
+
+    if index.duplicate_files or index.duplicate_sheets:
+        log(f"Found {len(index.duplicate_files)} duplicate files and "
+            f"{len(index.duplicate_sheets)} duplicate sheets")
+    return index
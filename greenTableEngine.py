@@ -0,0 +1,1067 @@
+import os
+import glob
+import time
+import itertools
+import traceback
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from greenTableReader import open_workbook
+from greenTableOutput import COL_START_KEY, SOURCES_COLUMN
+from greenTableTemplates import TemplateManager
+from greenTableProfile import same_file, call_profiled
+from greenTableIsolation import IsolatedExecutor, TaskFailure
+from greenTableDedup import find_duplicates
+from greenTableTelemetry import MISS_SAMPLES
+
+# Ширина полосы столбцов в индексе объединений по строкам (равна ширине блока)
+LAYOUT_BAND_WIDTH = 8
+
+# Файлы от этого размера при обработке пулом делятся по листам между процессами
+SHEET_SPLIT_MIN_BYTES = 2 * 1024 * 1024
+
+# Сколько задач на процесс может быть в работе или ждать сведения: результаты копятся
+# в памяти родителя, пока не сведены все предыдущие файлы
+TASKS_IN_FLIGHT_PER_WORKER = 2
+
+class MergedCellIndex:
+    """Индекс объединенных ячеек листа: (row, col) -> диапазон объединения"""
+    def __init__(self, merged_ranges, max_row=None, max_col=None):
+        self.ranges = list(merged_ranges)
+        self.cell_map = {}
+        # (строка, полоса столбцов) -> номера объединений, задевающих ее
+        self.bands = defaultdict(list)
+        # Есть ли пересекающиеся объединения (тогда важен их порядок)
+        self.overlapping = False
+        # Число обращений к индексу (для профиля)
+        self.lookup_count = 0
+
+        # Каждая ячейка внутри объединения указывает на свой диапазон.
+        # Ячейки за пределами используемой области листа не индексируем,
+        # чтобы случайные объединения на весь лист не раздували индекс
+        for idx, merged_range in enumerate(self.ranges):
+            last_row = merged_range.max_row if max_row is None else min(merged_range.max_row, max_row)
+            last_col = merged_range.max_col if max_col is None else min(merged_range.max_col, max_col)
+            for r in range(merged_range.min_row, last_row + 1):
+                for c in range(merged_range.min_col, last_col + 1):
+                    # При пересекающихся объединениях побеждает первое, как при линейном поиске
+                    if self.cell_map.setdefault((r, c), merged_range) is not merged_range:
+                        self.overlapping = True
+            for r in range(merged_range.min_row, last_row + 1):
+                for band in range(merged_range.min_col // LAYOUT_BAND_WIDTH, last_col // LAYOUT_BAND_WIDTH + 1):
+                    self.bands[r, band].append(idx)
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def find(self, row, col):
+        """Возвращает объединение, покрывающее ячейку, или None"""
+        self.lookup_count += 1
+        return self.cell_map.get((row, col))
+
+    def layout_key(self, min_row, min_col, max_row, max_col):
+        """Объединения, задевающие прямоугольник, относительно его левого верхнего угла.
+
+        Одинаковый ключ означает одинаковую структуру групп в этих прямоугольниках
+        """
+        self.lookup_count += 1
+        found = set()
+        for r in range(min_row, max_row + 1):
+            for band in range(min_col // LAYOUT_BAND_WIDTH, max_col // LAYOUT_BAND_WIDTH + 1):
+                found.update(self.bands.get((r, band), ()))
+        key = []
+        # Порядок объединений в файле произвольный и важен только при пересечениях
+        for idx in (sorted(found) if self.overlapping else found):
+            merged_range = self.ranges[idx]
+            if merged_range.max_col >= min_col and merged_range.min_col <= max_col:
+                key.append((
+                    merged_range.min_row - min_row, merged_range.min_col - min_col,
+                    merged_range.max_row - min_row, merged_range.max_col - min_col
+                ))
+        if not self.overlapping:
+            key.sort()
+        return tuple(key)
+
+    def find_covering(self, min_row, min_col, max_row, max_col):
+        """Возвращает объединение, целиком покрывающее прямоугольник, или None"""
+        # Такое объединение обязано содержать левый верхний угол прямоугольника
+        self.lookup_count += 1
+        merged_range = self.cell_map.get((min_row, min_col))
+        if (merged_range is not None and
+                merged_range.max_row >= max_row and
+                merged_range.max_col >= max_col):
+            return merged_range
+        return None
+
+def has_cell_data(value):
+    """Проверяет, что в ячейке есть данные (не None и не пустая строка)"""
+    return value is not None and str(value).strip() != ''
+
+has_cell_data_vec = np.frompyfunc(has_cell_data, 1, 1)
+
+class SheetSnapshot:
+    """Снимок значений листа в памяти: значения объединений размножены на все их ячейки.
+
+    sheet - лист читателя greenTableReader (rows, max_row, max_col, merged_ranges, is_filled)
+    """
+    def __init__(self, sheet):
+        self.max_row = sheet.max_row
+        self.max_col = sheet.max_col
+        self.merged_index = MergedCellIndex(sheet.merged_ranges, self.max_row, self.max_col)
+
+        # Значения используемой области листа
+        self.values = sheet.rows
+
+        # Значения левых верхних ячеек берем до перезаписи
+        anchor_values = {}
+        for merged_range in self.merged_index.ranges:
+            anchor_values[merged_range] = self.value(merged_range.min_row, merged_range.min_col)
+
+        for (r, c), merged_range in self.merged_index.cell_map.items():
+            self.values[r - 1][c - 1] = anchor_values[merged_range]
+
+        # Маска "в ячейке есть данные" для всего листа
+        grid = np.empty((self.max_row, self.max_col), dtype=object)
+        grid[:, :] = self.values
+        self.has_value = has_cell_data_vec(grid).astype(bool)
+
+        # Маска заливки нужна только для строк без данных:
+        # строка с данными в любом случае не является разделителем
+        self.has_fill = np.zeros((self.max_row, self.max_col), dtype=bool)
+        for row_idx in np.flatnonzero(~self.has_value.any(axis=1)) + 1:
+            for col_idx in range(1, self.max_col + 1):
+                if sheet.is_filled(int(row_idx), col_idx):
+                    self.has_fill[row_idx - 1, col_idx - 1] = True
+
+    def segment_chains(self):
+        """Делит лист на цепочки по пустым строкам без заливки.
+
+        Возвращает список (start_row, end_row, group_starts), где group_starts -
+        первые строки 3-строчных групп цепочки (3 строки сверху и 3 снизу пропускаются)
+        """
+        is_empty = ~(self.has_value.any(axis=1) | self.has_fill.any(axis=1))
+        empty_rows = np.flatnonzero(is_empty) + 1
+
+        # Цепочка начинается после пустой строки и заканчивается перед следующей
+        starts = np.concatenate(([1], empty_rows + 1))
+        ends = np.concatenate((empty_rows - 1, [self.max_row]))
+        keep = ends >= starts
+        starts, ends = starts[keep], ends[keep]
+
+        data_starts = starts + 3
+        num_groups = np.maximum((ends - 3 - data_starts + 1) // 3, 0)
+
+        chains = []
+        for start_row, end_row, data_start, count in zip(
+                starts.tolist(), ends.tolist(), data_starts.tolist(), num_groups.tolist()):
+            chains.append((start_row, end_row, list(range(data_start, data_start + 3 * count, 3))))
+        return chains
+
+    def value(self, row, col):
+        """Значение ячейки с учетом объединенных ячеек (нумерация с 1)"""
+        if 1 <= row <= self.max_row and 1 <= col <= self.max_col:
+            return self.values[row - 1][col - 1]
+        return None
+
+class GroupCell:
+    """Ячейка группы: положение относительно группы, размеры и значение"""
+    __slots__ = ('row', 'col', 'rowspan', 'colspan', 'required', 'value', 'absolute_row', 'absolute_col')
+
+    def __init__(self, row, col, rowspan, colspan, required, value, absolute_row, absolute_col):
+        self.row = row
+        self.col = col
+        self.rowspan = rowspan
+        self.colspan = colspan
+        self.required = required
+        self.value = value
+        self.absolute_row = absolute_row
+        self.absolute_col = absolute_col
+
+class GroupSkeleton:
+    """Структура группы без значений, общая для групп с одинаковым расположением объединений"""
+    __slots__ = ('cells', 'layout_id', 'giant')
+
+    def __init__(self, cells, layout_id=None, giant=None):
+        self.cells = cells          # (row, col, rowspan, colspan, смещение строки, смещение столбца)
+        self.layout_id = layout_id
+        self.giant = giant          # смещение гигантской ячейки, покрывающей группу, или None
+
+# Служебный ключ строки группы, на которой рабочий процесс создал шаблон
+NEW_TEMPLATE_MARKER = '_new_template'
+
+class ExcelProcessor:
+    """Разбор листов Excel по библиотеке шаблонов (без привязки к интерфейсу)"""
+    def __init__(self, template_manager, auto_create=True, log=print):
+        self.template_manager = template_manager
+        self.auto_create = auto_create
+        self.log = log
+        self.new_templates = []  # id шаблонов, созданных при обработке
+        # В рабочем процессе строки групп, создавших шаблон, тоже возвращаются:
+        # другой файл мог уже создать такой же шаблон, и тогда группа с ним совпала бы
+        self.keep_creation_rows = False
+        # Счетчики: sheets, groups, giant_groups, matched, auto_created, unmatched
+        self.stats = Counter()
+        # Результаты поиска шаблонов в текущем файле: (лист, fingerprint, увнк) -> id или None
+        # (во время разбора fingerprint компактный, после process_file - строковый)
+        self.lookups = {}
+        # Группы без шаблона в текущем файле: (лист, fingerprint, увнк) ->
+        # {'count', 'template' - id созданного шаблона или None, 'samples' - места групп}
+        self.misses = {}
+        # Структуры групп листа: (ширина, расположение объединений) -> GroupSkeleton
+        self.group_skeletons = {}
+        # Профиль последнего файла: время этапов и счетчики по листам (greenTableProfile)
+        self.file_profile = None
+        # (файл, куда сохранить статистику): разбор этого файла снимается cProfile
+        self.cprofile = None
+        
+    def log_message(self, message):
+        self.log(message)
+    
+    def analyze_group_structure(self, snapshot, group_start_row, col_start, col_end):
+        """Анализирует структуру группы и возвращает список ячеек (GroupCell) по строкам"""
+        merged_index = snapshot.merged_index
+        cells = []
+        processed_cells = set()
+
+        # Проверяем, есть ли гигантская ячейка, покрывающая всю группу
+        merged_range = merged_index.find_covering(group_start_row, col_start, group_start_row + 2, col_end)
+        if merged_range is not None:
+            # Гигантская ячейка покрывает всю группу
+            self.log_message(f"    WARNING: Giant cell covering entire group found at R{merged_range.min_row}C{merged_range.min_col}")
+            return []  # Возвращаем пустой список - группу пропускаем
+        
+        for row_offset in range(3):  # Группа всегда 3 строки
+            row_abs = group_start_row + row_offset
+            col_abs = col_start
+            
+            while col_abs <= col_end:
+                # Пропускаем уже обработанные ячейки
+                if (row_abs, col_abs) in processed_cells:
+                    col_abs += 1
+                    continue
+                
+                # Проверяем, является ли ячейка частью объединения
+                is_merged = False
+                rowspan = 1
+                colspan = 1
+                start_row_abs = row_abs
+                start_col_abs = col_abs
+                
+                merged_range = merged_index.find(row_abs, col_abs)
+                if merged_range is not None:
+                    # Это объединенная ячейка
+                    is_merged = True
+                    rowspan = merged_range.max_row - merged_range.min_row + 1
+                    colspan = merged_range.max_col - merged_range.min_col + 1
+                    start_row_abs = merged_range.min_row
+                    start_col_abs = merged_range.min_col
+
+                    # Проверяем, является ли эта ячейка верхней левой в объединении
+                    if row_abs == merged_range.min_row and col_abs == merged_range.min_col:
+                        # Это начало объединения - добавляем ячейку
+                        cell_value = snapshot.value(merged_range.min_row, merged_range.min_col)
+                        has_data = cell_value is not None and str(cell_value).strip() != ''
+
+                        cells.append(GroupCell(
+                            row_offset, col_abs - col_start, rowspan, colspan,
+                            has_data, cell_value, merged_range.min_row, merged_range.min_col
+                        ))
+
+                    # Помечаем все ячейки этого объединения как обработанные
+                    for r in range(merged_range.min_row, merged_range.max_row + 1):
+                        for c in range(merged_range.min_col, merged_range.max_col + 1):
+                            processed_cells.add((r, c))
+
+                    # Перескакиваем на следующий столбец после объединения
+                    col_abs = merged_range.max_col
+
+                if not is_merged:
+                    # Обычная ячейка
+                    cell_value = snapshot.value(row_abs, col_abs)
+                    has_data = cell_value is not None and str(cell_value).strip() != ''
+                    
+                    cells.append(GroupCell(
+                        row_offset, col_abs - col_start, 1, 1,
+                        has_data, cell_value, row_abs, col_abs
+                    ))
+                    
+                    processed_cells.add((row_abs, col_abs))
+                
+                col_abs += 1
+        
+        return cells
+    
+    def build_group(self, snapshot, group_start_row, col_start, col_end):
+        """Возвращает ячейки группы и ее компактный fingerprint (для гигантской ячейки - [], None).
+
+        Структура считается один раз на расположение объединений, для остальных групп
+        с тем же расположением читаются только значения
+        """
+        key = (col_end - col_start, snapshot.merged_index.layout_key(
+            group_start_row, col_start, group_start_row + 2, col_end
+        ))
+        skeleton = self.group_skeletons.get(key)
+        
+        if skeleton is None:
+            cells = self.analyze_group_structure(snapshot, group_start_row, col_start, col_end)
+            if not cells:
+                merged_range = snapshot.merged_index.find_covering(
+                    group_start_row, col_start, group_start_row + 2, col_end
+                )
+                giant = (merged_range.min_row - group_start_row, merged_range.min_col - col_start)
+                self.group_skeletons[key] = GroupSkeleton([], giant=giant)
+                return [], None
+            
+            skeleton_cells = [
+                (cell.row, cell.col, cell.rowspan, cell.colspan,
+                 cell.absolute_row - group_start_row, cell.absolute_col - col_start)
+                for cell in cells
+            ]
+            layout = tuple(cell[:4] for cell in skeleton_cells)
+            self.group_skeletons[key] = GroupSkeleton(skeleton_cells, self.template_manager.layout_id(layout))
+            return cells, self.template_manager.fingerprint_key(cells)
+        
+        if skeleton.giant is not None:
+            row_offset, col_offset = skeleton.giant
+            self.log_message(f"    WARNING: Giant cell covering entire group found at R{group_start_row + row_offset}C{col_start + col_offset}")
+            return [], None
+        
+        # Ячейки группы всегда внутри листа, поэтому значения берем напрямую
+        values = snapshot.values
+        cells = []
+        mask = 0
+        for bit, (row, col, rowspan, colspan, row_offset, col_offset) in enumerate(skeleton.cells):
+            absolute_row = group_start_row + row_offset
+            absolute_col = col_start + col_offset
+            cell_value = values[absolute_row - 1][absolute_col - 1]
+            has_data = cell_value is not None and str(cell_value).strip() != ''
+            if has_data:
+                mask |= 1 << bit
+            cells.append(GroupCell(row, col, rowspan, colspan, has_data, cell_value, absolute_row, absolute_col))
+        return cells, (skeleton.layout_id, mask)
+    
+    def extract_data_with_template(self, group_cells, template):
+        """Извлекает данные из группы с использованием шаблона"""
+        data = {}
+        
+        # Ячейки группы по позиции и размеру
+        cells_by_key = {}
+        for cell in group_cells:
+            key = (cell.row, cell.col, cell.rowspan, cell.colspan)
+            cells_by_key.setdefault(key, cell)
+        
+        # Извлекаем данные по скомпилированному плану шаблона
+        for key, output_column in self.template_manager.get_extraction_plan(template):
+            cell = cells_by_key.get(key)
+            if cell is not None:
+                data[output_column] = cell.value
+            else:
+                # Если ячейка не найдена, оставляем пустое значение
+                data[output_column] = ''
+        
+        return data
+    
+    def process_sheet(self, workbook, sheet_name):
+        """Обработка отдельного листа с новой логикой шаблонов"""
+        clock = time.perf_counter
+        timings = Counter()
+        counters = Counter()
+        
+        started = clock()
+        sheet = workbook[sheet_name]
+        timings['load'] += clock() - started
+        self.log_message(f"Processing sheet: {sheet_name}")
+        self.stats['sheets'] += 1
+        
+        # Определяем режим работы на основе названия листа
+        has_uvnk = 'увнк' in sheet_name.lower()
+        self.log_message(f"Режим работы: {'с УВНК' if has_uvnk else 'без УВНК'}")
+        
+        # Снимок значений и индекс объединений строятся один раз на лист
+        started = clock()
+        snapshot = SheetSnapshot(sheet)
+        timings['snapshot'] += clock() - started
+        self.group_skeletons = {}
+        self.log_message(f"Found {len(snapshot.merged_index)} merged cell ranges.")
+        
+        # Разделение на цепочки (chains) и группы по пустым строкам
+        started = clock()
+        chain_ranges = snapshot.segment_chains()
+        timings['segmentation'] += clock() - started
+        
+        all_data = []
+        new_templates_created = []
+        
+        for chain_idx, (start_row, end_row, group_starts) in enumerate(chain_ranges):
+            chain_height = end_row - start_row + 1
+            self.log_message(f"Processing chain {chain_idx+1}: rows {start_row} to {end_row} (высота: {chain_height})")
+            
+            # Определяем начальный столбец для блоков в зависимости от режима
+            first_block_start = 1 if has_uvnk else 2
+            
+            # Разбиваем цепочку на блоки по 8 столбцов
+            for col_start in range(first_block_start, snapshot.max_col + 1, 8):
+                col_end = min(col_start + 7, snapshot.max_col)
+                
+                # Проверяем, что в цепочке достаточно строк для групп
+                if chain_height < 9:  # Минимум 9 строк (3 сверху + 3 группа + 3 снизу)
+                    self.log_message(f"  Цепочка слишком короткая ({chain_height} строк), пропускаем")
+                    continue
+                
+                # Получаем дату из первой строки первого столбца блока
+                date_value = snapshot.value(start_row, col_start)
+                if not date_value:
+                    self.log_message(f"  Не найдена дата в ячейке ({start_row}, {col_start}), пропускаем блок")
+                    continue
+                
+                # Определяем печь
+                furnace_value = None
+                if has_uvnk:
+                    furnace_value = sheet_name
+                else:
+                    found_uppf = False
+                    
+                    # Ищем в первых трех строках блока
+                    for r in range(start_row, start_row + 3):
+                        for c in range(col_start, col_end + 1):
+                            cell_val = snapshot.value(r, c)
+                            if cell_val and "УППФ" in str(cell_val):
+                                furnace_value = cell_val
+                                found_uppf = True
+                                break
+                        if found_uppf:
+                            break
+                    
+                    if not found_uppf:
+                        furnace_value = ""
+                
+                # Группы уже размечены при разделении на цепочки
+                num_groups = len(group_starts)
+                
+                if num_groups <= 0:
+                    self.log_message("  No groups available in block")
+                    continue
+                
+                self.log_message(f"  Found {num_groups} groups in block")
+                
+                # Обрабатываем каждую группу в блоке
+                for group_idx, group_start_row in enumerate(group_starts):
+                    self.stats['groups'] += 1
+                    counters['groups'] += 1
+                    
+                    # Анализируем структуру группы; fingerprint компактный,
+                    # строка нужна только при создании шаблона
+                    started = clock()
+                    group_cells, group_fingerprint = self.build_group(
+                        snapshot, group_start_row, col_start, col_end
+                    )
+                    timings['group_analysis'] += clock() - started
+                    counters['group_cells'] += len(group_cells)
+                    
+                    # Если группа пустая (гигантская ячейка пропущена)
+                    if not group_cells:
+                        self.log_message(f"    Group {group_idx+1}: skipped (giant cell)")
+                        self.stats['giant_groups'] += 1
+                        continue
+                    
+                    # Ищем подходящий шаблон
+                    started = clock()
+                    template = self.template_manager.find_template(sheet_name, group_fingerprint, has_uvnk)
+                    timings['matching'] += clock() - started
+                    counters['template_hits' if template else 'template_misses'] += 1
+                    # Для кеша важен первый результат: группа без шаблона создает его
+                    self.lookups.setdefault(
+                        (sheet_name, group_fingerprint, has_uvnk),
+                        template['id'] if template else None
+                    )
+                    if not template:
+                        miss = self.misses.setdefault(
+                            (sheet_name, group_fingerprint, has_uvnk),
+                            {'count': 0, 'template': None, 'samples': []}
+                        )
+                        miss['count'] += 1
+                        if len(miss['samples']) < MISS_SAMPLES:
+                            miss['samples'].append({
+                                'sheet': sheet_name, 'block': chain_idx + 1, 'group': group_idx + 1,
+                                'row': group_start_row, 'col': col_start
+                            })
+
+                    if template:
+                        # Используем существующий шаблон
+                        started = clock()
+                        group_data = self.extract_data_with_template(group_cells, template)
+                        timings['extraction'] += clock() - started
+                        
+                        # Добавляем метаданные
+                        group_data['Date'] = date_value
+                        group_data['Furnace'] = furnace_value
+                        group_data['Group'] = group_idx + 1
+                        group_data['Block'] = chain_idx + 1
+                        group_data['Sheet'] = sheet_name
+                        group_data['Template'] = template['id']
+                        group_data[COL_START_KEY] = col_start
+                        
+                        all_data.append(group_data)
+                        
+                        self.log_message(f"    Group {group_idx+1}: used template '{template['name']}'")
+                        self.stats['matched'] += 1
+                    
+                    elif self.auto_create:
+                        # Создаем новый шаблон
+                        started = clock()
+                        new_template = self.template_manager.create_new_template(
+                            sheet_name, 
+                            group_cells,
+                            has_uvnk,
+                            f"Auto-created from sheet {sheet_name}, chain {chain_idx+1}, block starting col {col_start}"
+                        )
+                        timings['template_creation'] += clock() - started
+                        
+                        new_templates_created.append(new_template['id'])
+                        miss['template'] = new_template['id']
+
+                        self.log_message(f"    Group {group_idx+1}: created new template '{new_template['name']}'")
+                        self.stats['auto_created'] += 1
+                        
+                        # Если в шаблоне уже есть output_column, можно сразу использовать
+                        has_output_columns = any(cell.get('output_column', '') for cell in new_template['cells'])
+                        if has_output_columns or self.keep_creation_rows:
+                            started = clock()
+                            group_data = self.extract_data_with_template(group_cells, new_template)
+                            timings['extraction'] += clock() - started
+                            group_data['Date'] = date_value
+                            group_data['Furnace'] = furnace_value
+                            group_data['Group'] = group_idx + 1
+                            group_data['Block'] = chain_idx + 1
+                            group_data['Sheet'] = sheet_name
+                            group_data['Template'] = new_template['id']
+                            group_data[COL_START_KEY] = col_start
+                            if not has_output_columns:
+                                # Решение о строке принимает родитель при сведении шаблонов
+                                group_data[NEW_TEMPLATE_MARKER] = True
+                            all_data.append(group_data)
+                    
+                    else:
+                        self.log_message(f"    Group {group_idx+1}: no template found and auto-create disabled")
+                        self.stats['unmatched'] += 1
+        
+        if new_templates_created:
+            self.log_message(f"Created {len(new_templates_created)} new templates")
+            self.new_templates.extend(new_templates_created)
+        
+        counters['cells_loaded'] += snapshot.max_row * snapshot.max_col
+        counters['merged_ranges'] += len(snapshot.merged_index)
+        counters['merged_lookups'] += snapshot.merged_index.lookup_count
+        # Структура считается заново только для нового расположения объединений
+        skeleton_misses = len(self.group_skeletons)
+        counters['skeleton_misses'] += skeleton_misses
+        counters['skeleton_hits'] += counters['groups'] - skeleton_misses
+        if self.file_profile is not None:
+            self.file_profile['sheets'].append({
+                'sheet': sheet_name, 'stages': dict(timings), 'counters': dict(counters)
+            })
+        
+        return all_data
+    
+    def process_file(self, input_file, sheet_names=None):
+        """Обрабатывает листы файла (по умолчанию все) и возвращает извлеченные строки"""
+        if self.cprofile is not None and same_file(self.cprofile[0], input_file):
+            self.log_message(f"Profiling {input_file} into {self.cprofile[1]}")
+            return call_profiled(self.cprofile[1], self.parse_file, input_file, sheet_names)
+        return self.parse_file(input_file, sheet_names)
+    
+    def parse_file(self, input_file, sheet_names=None):
+        """Разбор файла; профиль разбора остается в file_profile"""
+        self.lookups = {}
+        self.misses = {}
+        self.file_profile = {
+            'file': input_file,
+            'stages': {},
+            'counters': {'bytes_read': os.path.getsize(input_file)},
+            'sheets': [],
+        }
+        
+        started = time.perf_counter()
+        workbook = open_workbook(input_file, self.log_message)
+        self.file_profile['stages']['open'] = time.perf_counter() - started
+        
+        file_data = []
+        try:
+            for sheet_name in (workbook.sheetnames if sheet_names is None else sheet_names):
+                sheet_data = self.process_sheet(workbook, sheet_name)
+                file_data.extend(sheet_data)
+                self.log_message(f"  Extracted {len(sheet_data)} rows from {sheet_name}")
+        finally:
+            workbook.close()
+        
+        # Номера расположений локальны для библиотеки процесса - наружу отдаем строки
+        self.lookups = {
+            (sheet_name, self.template_manager.format_fingerprint(key), has_uvnk): template_id
+            for (sheet_name, key, has_uvnk), template_id in self.lookups.items()
+        }
+        self.misses = {
+            (sheet_name, self.template_manager.format_fingerprint(key), has_uvnk): miss
+            for (sheet_name, key, has_uvnk), miss in self.misses.items()
+        }
+        return file_data
+
+# Состояние рабочего процесса пула
+_worker_templates = []
+_worker_auto_create = True
+_worker_cprofile = None
+_worker_memory_limited = False
+
+def _init_worker(templates, auto_create, cprofile=None, memory_limited=False):
+    """Инициализирует рабочий процесс копией библиотеки шаблонов"""
+    global _worker_templates, _worker_auto_create, _worker_cprofile, _worker_memory_limited
+    _worker_templates = templates
+    _worker_auto_create = auto_create
+    _worker_cprofile = cprofile
+    _worker_memory_limited = memory_limited
+
+def _process_file_in_worker(task):
+    """Обрабатывает файл или часть его листов в рабочем процессе.
+
+    task - (файл, имена листов или None для всех листов). Процесс сам открывает
+    файл и читает только свои листы.
+    Каждая задача разбирается от исходной библиотеки, поэтому результат не зависит
+    от того, какие файлы этот процесс обработал раньше.
+    Возвращает (строки, новые шаблоны, сообщения лога, успех, счетчики, поиски шаблонов,
+    профиль файла, группы без шаблона)
+    """
+    input_file, sheet_names = task
+    log_lines = []
+    template_manager = TemplateManager(templates=list(_worker_templates))
+    processor = ExcelProcessor(template_manager, _worker_auto_create, log=log_lines.append)
+    processor.keep_creation_rows = True
+    processor.cprofile = _worker_cprofile
+    
+    try:
+        file_data = processor.process_file(input_file, sheet_names)
+        ok = True
+    except Exception as e:
+        if isinstance(e, MemoryError) and _worker_memory_limited:
+            # Файл превысил бюджет памяти: процесс заменяется, файл уходит в карантин
+            raise
+        file_data = []
+        ok = False
+        log_lines.append(f"Error processing file {input_file}: {str(e)}")
+        log_lines.append(traceback.format_exc())
+    
+    # Отдаем шаблоны, созданные этим файлом, - родитель сведет их в общую библиотеку
+    new_templates = template_manager.templates[len(_worker_templates):]
+    return (file_data, new_templates, log_lines, ok, processor.stats, processor.lookups,
+            processor.file_profile, processor.misses if ok else {})
+
+def merge_worker_templates(template_manager, new_templates):
+    """Сводит шаблоны, созданные рабочим процессом, в библиотеку.
+
+    Шаблон, который уже нашелся бы в библиотеке, повторно не добавляется.
+    Возвращает соответствие id рабочего процесса -> id в библиотеке
+    """
+    id_map = {}
+    for template in new_templates:
+        worker_id = template['id']
+        existing = template_manager.find_template(
+            template['sheet'], template['fingerprint'], template.get('has_uvnk', False)
+        )
+        if existing is None:
+            existing = template_manager.add_template(template)
+        id_map[worker_id] = existing['id']
+    return id_map
+
+def ordered_results(executor, func, tasks, window):
+    """Как executor.map, но в работе и в ожидании выдачи не больше window задач.
+
+    Следующая задача отправляется, когда выдан результат самой ранней
+    """
+    tasks = iter(tasks)
+    pending = deque(executor.submit(func, task) for task in itertools.islice(tasks, window))
+    while pending:
+        result = pending.popleft().result()
+        for task in itertools.islice(tasks, 1):
+            pending.append(executor.submit(func, task))
+        yield result
+
+def sheet_tasks(input_file, split, sheet_names=None):
+    """Задачи рабочих процессов для файла: весь файл или, если split, по листу на задачу.
+
+    sheet_names - только эти листы файла (None - все)
+    """
+    if sheet_names is not None:
+        if split:
+            return [(input_file, [sheet_name]) for sheet_name in sheet_names]
+        return [(input_file, sheet_names)]
+    if split:
+        try:
+            workbook = open_workbook(input_file, lambda message: None)
+            try:
+                sheet_names = list(workbook.sheetnames)
+            finally:
+                workbook.close()
+            if len(sheet_names) > 1:
+                return [(input_file, [sheet_name]) for sheet_name in sheet_names]
+        except Exception:
+            # Ошибку открытия сообщит рабочий процесс
+            pass
+    return [(input_file, None)]
+
+def process_files(excel_files, template_manager, auto_create=True, workers=1, log=print,
+                  progress=None, file_done=None, cancelled=None, stats=None, cache=None, sink=None,
+                  profile=None, timeout=None, memory_limit=None, quarantine=None, dedup=None,
+                  telemetry=None, unsettled=None):
+    """Обрабатывает файлы последовательно или пулом процессов.
+
+    Строки возвращаются в порядке файлов независимо от того, какой процесс
+    закончил первым. progress(file_idx, total) вызывается перед файлом,
+    file_done(input_file, rows, ok) - после него; cancelled() проверяется
+    между файлами. Счетчики обработки добавляются в stats (Counter), если он передан.
+    Неизмененные файлы берутся из cache (ResultCache), если он передан.
+    Если передан sink (greenTableOutput), строки каждого файла сразу уходят в него
+    и в памяти не копятся.
+    При обработке пулом большие файлы (от SHEET_SPLIT_MIN_BYTES, а если файлов меньше,
+    чем процессов, - все) делятся по листам; строки листов сводятся в порядке листов.
+    В profile (greenTableProfile.RunProfile), если он передан, попадают время этапов
+    и счетчики каждого файла и время записи строк.
+    Если задан timeout (секунд) или memory_limit (МБ), каждый файл разбирается
+    в отдельном процессе, который убивается при превышении; такой файл считается
+    ошибочным и попадает в quarantine (greenTableCache.Quarantine), если он передан.
+    Файлы из quarantine пропускаются, пока не изменятся.
+    С dedup ('first' или 'tag') файлы с одинаковым содержимым и одинаковые листы .xlsx
+    разбираются один раз (greenTableDedup), повторы пропускаются; при 'tag' у строк
+    есть столбец Sources со всеми путями, где встречается их лист.
+    В telemetry (greenTableTelemetry.MatchTelemetry), если он передан, попадают строки
+    каждого файла по шаблонам и группы, для которых шаблон не нашелся.
+    Файлы из unsettled (еще дописываются) не разбираются: в результат идут их строки
+    из последнего разбора в cache, если они есть.
+    Возвращает (строки, id новых шаблонов)
+    """
+    all_data = []
+    new_templates = []
+    total_files = len(excel_files)
+    if stats is None:
+        stats = Counter()
+    
+    def emit(rows, input_file, complete=True):
+        # complete=False - файл разобран с ошибкой: его прежние строки в базе не удаляются
+        if dedup == 'tag':
+            # Копии строк: строки файла без отметок могут уйти в кеш
+            rows = [
+                dict(row, **{SOURCES_COLUMN: '; '.join(duplicates.sources(input_file, row.get('Sheet')))})
+                for row in rows
+            ]
+        stats['rows'] += len(rows)
+        if sink is not None:
+            started = time.perf_counter()
+            sink.write_rows(rows, input_file, complete)
+            if profile is not None:
+                profile.add_export(time.perf_counter() - started, len(rows))
+        else:
+            all_data.extend(rows)
+    
+    # Повторы файлов и листов находятся до разбора
+    duplicates = find_duplicates(excel_files, log, cache) if dedup else None
+    
+    def parse_sheets(input_file):
+        """Листы файла для разбора (None - все)"""
+        return duplicates.sheets_to_parse(input_file) if duplicates is not None else None
+    
+    # Файлы, строки которых можно взять из кеша
+    cached = {}
+    unsettled = set(unsettled or ())
+    if cache is not None:
+        cache.begin_run(template_manager, auto_create)
+        for input_file in excel_files:
+            if input_file in unsettled:
+                entry = cache.previous(input_file)
+                if entry is not None:
+                    cached[input_file] = entry
+                continue
+            if duplicates is not None and (input_file in duplicates.duplicate_files or
+                                           duplicates.skipped_sheets(input_file)):
+                # В кеше строки всех листов файла
+                continue
+            entry = cache.get(input_file)
+            if entry is not None:
+                cached[input_file] = entry
+    
+    # Файлы, которые раньше превысили лимиты и с тех пор не менялись
+    quarantined = {}
+    if quarantine is not None:
+        for input_file in excel_files:
+            if input_file in unsettled:
+                continue
+            reason = quarantine.get(input_file)
+            if reason is not None and input_file not in cached:
+                quarantined[input_file] = reason
+    files_to_parse = [
+        f for f in excel_files
+        if f not in cached and f not in quarantined and f not in unsettled and
+        not (duplicates and f in duplicates.duplicate_files)
+    ]
+    
+    # Задачи рабочих процессов по файлам
+    isolate = bool(timeout or memory_limit)
+    file_tasks = {}
+    if workers > 1 or isolate:
+        split_all = workers > 1 and len(files_to_parse) < workers
+        for input_file in files_to_parse:
+            # Профилируемый cProfile файл разбирается целиком в одном процессе
+            profiled = (profile is not None and profile.cprofile_file and
+                        same_file(profile.cprofile_file, input_file))
+            try:
+                large = os.path.getsize(input_file) >= SHEET_SPLIT_MIN_BYTES
+            except OSError:
+                large = False
+            split = workers > 1 and (split_all or large) and not profiled
+            file_tasks[input_file] = sheet_tasks(input_file, split, parse_sheets(input_file))
+    tasks = [task for input_file in files_to_parse for task in file_tasks.get(input_file, [])]
+    
+    def use_cached(input_file):
+        rows, file_stats = cached[input_file]
+        if telemetry is not None:
+            telemetry.add_file(input_file, rows)
+        if (sink is not None and sink.incremental and dedup != 'tag' and
+                sink.has_file(input_file)):
+            # Строки неизмененного файла уже в базе (Sources при tag могли измениться)
+            log(f"  Unchanged, {len(rows)} rows already in {sink.output_file}")
+            stats['rows'] += len(rows)
+        elif input_file in unsettled:
+            log(f"  Still changing, using {len(rows)} rows from the previous parse")
+            emit(rows, input_file)
+        else:
+            log(f"  Unchanged, using {len(rows)} cached rows")
+            emit(rows, input_file)
+        if profile is not None:
+            profile.add_cached_file(input_file, len(rows))
+        stats.update(file_stats)
+        stats['files'] += 1
+        stats['cached_files'] += 1
+        if file_done:
+            file_done(input_file, len(rows), True)
+    
+    def skip_duplicate(input_file):
+        """Пропускает копию более раннего файла; для остальных файлов - сообщает о пропущенных листах"""
+        if duplicates is None:
+            return False
+        if input_file in duplicates.duplicate_files:
+            log(f"  Duplicate of {duplicates.duplicate_files[input_file]}, skipping")
+            stats['duplicate_files'] += 1
+            # Строки копии - у первого файла; прежние строки самой копии в базе больше не нужны
+            emit([], input_file)
+            if telemetry is not None:
+                telemetry.add_file(input_file, [], {})
+            if file_done:
+                file_done(input_file, 0, True)
+            return True
+        for sheet_name in duplicates.skipped_sheets(input_file):
+            first_file, first_sheet = duplicates.duplicate_sheets[input_file, sheet_name]
+            log(f"  Sheet {sheet_name} duplicates sheet {first_sheet} of {first_file}, skipping")
+            stats['duplicate_sheets'] += 1
+        return False
+    
+    def skip_quarantined(input_file):
+        log(f"  Quarantined ({quarantined[input_file]}), skipping until the file changes")
+        stats['quarantined_files'] += 1
+        if telemetry is not None:
+            telemetry.add_file(input_file, [], {})
+        if file_done:
+            file_done(input_file, 0, False)
+    
+    try:
+        if not tasks or (len(tasks) == 1 and not isolate):
+            processor = ExcelProcessor(template_manager, auto_create, log)
+            processor.stats = stats
+            if profile is not None:
+                processor.cprofile = profile.cprofile
+            for file_idx, input_file in enumerate(excel_files):
+                if cancelled and cancelled():
+                    log("Processing cancelled")
+                    break
+                if progress:
+                    progress(file_idx, total_files)
+                log(f"Processing file {file_idx+1}/{total_files}: {os.path.basename(input_file)}")
+                
+                if input_file in cached:
+                    use_cached(input_file)
+                    continue
+                if input_file in quarantined:
+                    skip_quarantined(input_file)
+                    continue
+                if input_file in unsettled:
+                    log("  Still changing and never parsed, skipping")
+                    continue
+                if skip_duplicate(input_file):
+                    continue
+                
+                file_data = []
+                ok = True
+                stats_before = Counter(stats)
+                processor.file_profile = None
+                try:
+                    file_data = processor.process_file(input_file, parse_sheets(input_file))
+                except Exception as e:
+                    ok = False
+                    log(f"Error processing file {input_file}: {str(e)}")
+                    log(traceback.format_exc())
+                # Счетчики разбора файла для кеша (без files и rows - их считает use_cached)
+                file_stats = stats - stats_before
+                if telemetry is not None:
+                    telemetry.add_file(input_file, file_data, processor.misses if ok else {})
+                emit(file_data, input_file, ok)
+                if profile is not None and processor.file_profile is not None:
+                    profile.add_file(processor.file_profile, ok, len(file_data))
+                stats['files'] += 1
+                if not ok:
+                    stats['failed_files'] += 1
+                
+                # Новые шаблоны файла сохраняются одной записью
+                template_manager.flush()
+                if ok and cache is not None and parse_sheets(input_file) is None:
+                    cache.put(input_file, file_data, processor.lookups, file_stats)
+                if file_done:
+                    file_done(input_file, len(file_data), ok)
+            
+            return all_data, processor.new_templates
+        
+        # Рабочие процессы получают снимок библиотеки на момент запуска
+        template_manager.flush()
+        initargs = (template_manager.templates, auto_create,
+                    profile.cprofile if profile is not None else None, bool(memory_limit))
+        pool_size = min(workers, len(tasks))
+        # Медленный ранний файл не дает результатам остальных копиться в памяти без предела
+        window = pool_size * TASKS_IN_FLIGHT_PER_WORKER
+        if isolate:
+            executor = IsolatedExecutor(max_workers=pool_size, initializer=_init_worker,
+                                        initargs=initargs, timeout=timeout,
+                                        memory_limit=memory_limit * 1024 * 1024 if memory_limit else None)
+        else:
+            executor = ProcessPoolExecutor(max_workers=pool_size, initializer=_init_worker, initargs=initargs)
+        with executor:
+            if isolate:
+                results = executor.map(_process_file_in_worker, tasks, window=window)
+            else:
+                results = ordered_results(executor, _process_file_in_worker, tasks, window)
+            for file_idx, input_file in enumerate(excel_files):
+                if cancelled and cancelled():
+                    log("Processing cancelled")
+                    # Файлы, которые еще не начаты, снимаем с очереди
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                if progress:
+                    progress(file_idx, total_files)
+                log(f"Processing file {file_idx+1}/{total_files}: {os.path.basename(input_file)}")
+                
+                if input_file in cached:
+                    use_cached(input_file)
+                    continue
+                if input_file in quarantined:
+                    skip_quarantined(input_file)
+                    continue
+                if input_file in unsettled:
+                    log("  Still changing and never parsed, skipping")
+                    continue
+                if skip_duplicate(input_file):
+                    continue
+                
+                parts = file_tasks[input_file]
+                if len(parts) > 1:
+                    log(f"  Parsed in {len(parts)} sheet parts")
+                
+                file_rows = []
+                file_stats = Counter()
+                file_lookups = {}
+                file_misses = {}
+                file_profile = None
+                file_ok = True
+                failure = None
+                for _ in parts:
+                    result = next(results)
+                    if isinstance(result, TaskFailure):
+                        # Процесс убит: часть файла дает пустой результат
+                        failure = result.reason
+                        log(f"Error processing file {input_file}: {failure}")
+                        result = ([], [], [], False, Counter(), {}, None, {})
+                    (part_data, worker_templates, log_lines, ok, part_stats, lookups, part_profile,
+                     misses) = result
+                    file_ok = file_ok and ok
+                    for line in log_lines:
+                        log(line)
+                    
+                    # Шаблоны и строки сводятся строго в порядке файлов и их листов
+                    templates_before = len(template_manager.templates)
+                    id_map = merge_worker_templates(template_manager, worker_templates)
+                    added = [t['id'] for t in template_manager.templates[templates_before:]]
+                    
+                    for row in part_data:
+                        created_here = row.pop(NEW_TEMPLATE_MARKER, False)
+                        if row.get('Template') in id_map:
+                            row['Template'] = id_map[row['Template']]
+                        # Группа, создавшая действительно новый шаблон, строки не дает
+                        if created_here and row['Template'] in added:
+                            continue
+                        if created_here:
+                            # При последовательной обработке группа совпала бы с шаблоном другого файла или листа
+                            part_stats['auto_created'] -= 1
+                            part_stats['matched'] += 1
+                        file_rows.append(row)
+                    file_stats.update(part_stats)
+                    new_templates.extend(added)
+                    
+                    # Для кеша важен первый результат поиска в файле
+                    for key, template_id in lookups.items():
+                        file_lookups.setdefault(key, id_map.get(template_id, template_id))
+                    for key, miss in misses.items():
+                        template_id = id_map.get(miss['template'], miss['template'])
+                        if template_id is not None and template_id not in added:
+                            # Шаблон уже был в библиотеке: при последовательной обработке группа совпала бы с ним
+                            continue
+                        file_misses.setdefault(key, dict(miss, template=template_id))
+                    
+                    if part_profile is not None:
+                        if file_profile is None:
+                            file_profile = dict(part_profile, stages=dict(part_profile['stages']),
+                                                sheets=list(part_profile['sheets']))
+                        else:
+                            file_profile['stages']['open'] = (file_profile['stages'].get('open', 0) +
+                                                              part_profile['stages'].get('open', 0))
+                            file_profile['sheets'].extend(part_profile['sheets'])
+                
+                stats['files'] += 1
+                if not file_ok:
+                    stats['failed_files'] += 1
+                if not file_ok:
+                    # Как при последовательной обработке, файл с ошибкой в любой части строк не дает
+                    file_rows = []
+                    file_misses = {}
+                if failure is not None:
+                    if quarantine is not None:
+                        quarantine.add(input_file, failure)
+                        log(f"  Quarantined: {failure}")
+                if telemetry is not None:
+                    telemetry.add_file(input_file, file_rows, file_misses)
+                emit(file_rows, input_file, file_ok)
+                stats.update(file_stats)
+                if profile is not None and file_profile is not None:
+                    profile.add_file(file_profile, file_ok, len(file_rows))
+                
+                template_manager.flush()
+                if file_ok and cache is not None and parse_sheets(input_file) is None:
+                    cache.put(input_file, file_rows, file_lookups, file_stats)
+                if file_done:
+                    file_done(input_file, len(file_rows), file_ok)
+        
+        return all_data, new_templates
+    finally:
+        if cache is not None:
+            cache.save()
+        if quarantine is not None:
+            quarantine.save()
+        if telemetry is not None:
+            telemetry.save(template_manager)
+
+def find_excel_files(directory):
+    """Рекурсивно ищет файлы Excel в директории"""
+    excel_files = glob.glob(os.path.join(directory, "**", "*.xlsx"), recursive=True)
+    excel_files.extend(glob.glob(os.path.join(directory, "**", "*.xls"), recursive=True))
+    return excel_files
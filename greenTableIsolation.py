@@ -0,0 +1,192 @@
+import time
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+try:
+    import resource
+except ImportError:  # Windows: ограничение памяти процесса недоступно
+    resource = None
+
+# Первое сообщение рабочего процесса: запуск и initializer закончены
+WORKER_READY = 'ready'
+
+class TaskFailure:
+    """Результат задачи, процесс которой убит по времени или памяти или упал"""
+    __slots__ = ('reason',)
+
+    def __init__(self, reason):
+        self.reason = reason
+
+def _isolated_worker(conn, func, initializer, initargs, memory_limit):
+    """Цикл рабочего процесса: задачи по одной из conn, результаты обратно"""
+    if memory_limit and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    if initializer is not None:
+        initializer(*initargs)
+    conn.send(WORKER_READY)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        try:
+            result = func(task)
+        except MemoryError:
+            # Состояние процесса после нехватки памяти ненадежно - процесс заменяется
+            result = None
+        try:
+            conn.send(result)
+        except MemoryError:
+            return
+        if result is None:
+            return
+
+class IsolatedWorker:
+    """Рабочий процесс, которого можно убить, не затрагивая остальные"""
+    def __init__(self, func, initializer, initargs, memory_limit):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_isolated_worker,
+            args=(child_conn, func, initializer, initargs, memory_limit),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.index = None
+        self.started = None
+        # Время задачи считается с готовности процесса: запуск, импорт модулей
+        # и initializer (при spawn - секунды) в предел времени файла не входят
+        self.ready = False
+
+    def submit(self, index, task):
+        self.index = index
+        self.started = time.monotonic() if self.ready else None
+        self.conn.send(task)
+
+    def set_ready(self):
+        self.ready = True
+        if self.index is not None:
+            self.started = time.monotonic()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+class IsolatedExecutor:
+    """Пул процессов с ограничением времени и памяти на задачу.
+
+    Повторяет используемую часть ProcessPoolExecutor (map, shutdown, with), но задача,
+    превысившая timeout секунд, убивается вместе со своим процессом, а процесс,
+    упавший или превысивший memory_limit байт, заменяется новым. Вместо результата
+    такой задачи map отдает TaskFailure, остальные задачи не прерываются.
+    Память ограничивается через RLIMIT_AS, только там, где есть модуль resource
+    """
+    def __init__(self, max_workers=1, initializer=None, initargs=(), timeout=None, memory_limit=None):
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.workers = []
+        self.queue = deque()
+        self.shutting_down = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.shutdown()
+        return False
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shutting_down = True
+        self.queue.clear()
+        for worker in self.workers:
+            if worker.index is None:
+                worker.stop()
+            else:
+                # Задача еще выполняется - ее результат больше не нужен
+                worker.kill()
+        self.workers = []
+
+    def start_worker(self, func):
+        worker = IsolatedWorker(func, self.initializer, self.initargs, self.memory_limit)
+        self.workers.append(worker)
+        return worker
+
+    def map(self, func, tasks, window=None):
+        """Результаты задач по порядку. window - сколько задач, считая первую невыданную,
+        могут выполняться или ждать выдачи (None - без ограничения)"""
+        self.queue = deque(enumerate(tasks))
+        total = len(self.queue)
+        done = {}
+        next_index = 0
+
+        while next_index < total and not self.shutting_down:
+            # Результаты отдаются в порядке задач
+            if next_index in done:
+                yield done.pop(next_index)
+                next_index += 1
+                continue
+
+            # Свободным процессам - следующие задачи, но не дальше окна от первой невыданной
+            limit = next_index + window if window else total
+            for worker in self.workers:
+                if worker.index is None and self.queue and self.queue[0][0] < limit:
+                    worker.submit(*self.queue.popleft())
+            while self.queue and self.queue[0][0] < limit and len(self.workers) < self.max_workers:
+                self.start_worker(func).submit(*self.queue.popleft())
+
+            busy = [worker for worker in self.workers if worker.index is not None]
+            wait_time = None
+            if self.timeout:
+                deadlines = [worker.started + self.timeout for worker in busy if worker.started is not None]
+                if deadlines:
+                    wait_time = max(0, min(deadlines) - time.monotonic())
+            wait([worker.conn for worker in busy] + [worker.process.sentinel for worker in busy], wait_time)
+
+            for worker in busy:
+                failure = None
+                if worker.conn.poll():
+                    try:
+                        result = worker.conn.recv()
+                    except (EOFError, OSError):
+                        result = None
+                        failure = f"worker process crashed (exit code {worker.process.exitcode})"
+                    if result == WORKER_READY and not worker.ready:
+                        worker.set_ready()
+                        continue
+                    if result is None and failure is None:
+                        limit_mb = (self.memory_limit or 0) // (1024 * 1024)
+                        failure = f"memory limit of {limit_mb} MB exceeded"
+                    if failure is None:
+                        done[worker.index] = result
+                        worker.index = None
+                        continue
+                elif not worker.process.is_alive():
+                    failure = f"worker process crashed (exit code {worker.process.exitcode})"
+                elif (self.timeout and worker.started is not None and
+                      time.monotonic() - worker.started >= self.timeout):
+                    failure = f"timed out after {self.timeout:g} s"
+                else:
+                    continue
+
+                done[worker.index] = TaskFailure(failure)
+                worker.index = None
+                worker.kill()
+                self.workers.remove(worker)
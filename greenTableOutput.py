@@ -0,0 +1,267 @@
+import os
+import csv
+import time
+import pickle
+import sqlite3
+import datetime
+import tempfile
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Border, Side, Alignment
+
+# Столбцы метаданных группы, всегда идут первыми
+BASE_COLUMNS = ['Date', 'Furnace', 'Group', 'Block', 'Sheet', 'Template']
+# Пути всех копий листа строки (при отметке повторов), идет сразу после метаданных
+SOURCES_COLUMN = 'Sources'
+# Служебный ключ строки: первый столбец блока группы (часть ключа строки в SQLite)
+COL_START_KEY = '_col_start'
+
+class ResultSink:
+    """Потоковая запись извлеченных строк.
+
+    Строки по мере поступления сбрасываются во временный файл на диске, в памяти
+    остается только набор встреченных столбцов. Выходной файл пишется при close():
+    сначала метаданные, затем остальные столбцы по алфавиту.
+    """
+    # Выходной файл каждый раз пишется целиком (строки всех файлов)
+    incremental = False
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.rows = 0
+        self.columns_seen = set()
+        self.spool = tempfile.TemporaryFile()
+
+    def write_rows(self, rows, input_file=None, complete=True):
+        """Добавляет строки одного файла"""
+        if not rows:
+            return
+        for row in rows:
+            self.columns_seen.update(row)
+        pickle.dump(rows, self.spool, protocol=pickle.HIGHEST_PROTOCOL)
+        self.rows += len(rows)
+
+    def columns(self):
+        # Служебные ключи строк (с "_") в выходной файл не попадают
+        leading = BASE_COLUMNS + [SOURCES_COLUMN] if SOURCES_COLUMN in self.columns_seen else BASE_COLUMNS
+        return leading + sorted(
+            col for col in self.columns_seen if col not in leading and not col.startswith('_')
+        )
+
+    def spooled_rows(self):
+        self.spool.seek(0)
+        while True:
+            try:
+                rows = pickle.load(self.spool)
+            except EOFError:
+                return
+            yield from rows
+
+    def close(self):
+        """Записывает выходной файл через временный, чтобы не оставить наполовину записанный результат"""
+        columns = self.columns()
+        root, ext = os.path.splitext(self.output_file)
+        tmp_file = root + ".tmp" + ext
+        try:
+            self.write_file(tmp_file, columns)
+            os.replace(tmp_file, self.output_file)
+        except Exception:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+        finally:
+            self.spool.close()
+        return columns
+
+    def abort(self):
+        """Отбрасывает накопленные строки, выходной файл не трогается"""
+        self.spool.close()
+
+    def write_file(self, path, columns):
+        raise NotImplementedError
+
+class ExcelSink(ResultSink):
+    """Запись в .xlsx через write-only книгу openpyxl"""
+    def write_file(self, path, columns):
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("Sheet1")
+
+        # Оформление заголовка как при сохранении через pandas
+        side = Side(style='thin')
+        header = []
+        for column in columns:
+            cell = WriteOnlyCell(sheet, value=column)
+            cell.font = Font(bold=True)
+            cell.border = Border(left=side, right=side, top=side, bottom=side)
+            cell.alignment = Alignment(horizontal='center', vertical='top')
+            header.append(cell)
+        sheet.append(header)
+
+        for row in self.spooled_rows():
+            sheet.append([row.get(column) for column in columns])
+        workbook.save(path)
+
+class CsvSink(ResultSink):
+    """Запись в .csv (разделитель ';', utf-8-sig, чтобы Excel правильно открыл кириллицу)"""
+    def write_file(self, path, columns):
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f, delimiter=';')
+            writer.writerow(columns)
+            for row in self.spooled_rows():
+                writer.writerow(['' if row.get(column) is None else row.get(column) for column in columns])
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def sqlite_value(value):
+    """Значение ячейки в виде, который хранит SQLite (даты - ISO-строкой)"""
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat(' ') if isinstance(value, datetime.datetime) else value.isoformat()
+    return str(value)
+
+class SqliteSink:
+    """Запись в базу SQLite: строка группы по ключу (файл, лист, блок, группа, столбец блока).
+
+    Повторный запуск обновляет строки по ключу (upsert), строки файла, которых
+    в новом разборе нет, удаляются; строки других файлов не трогаются.
+    Date, Furnace и Template проиндексированы, столбцы шаблонов добавляются по мере появления.
+    Весь запуск пишется одной транзакцией: abort() оставляет базу как была
+    """
+    TABLE = 'groups'
+    # Достаточно записать строки изменившихся файлов, остальные остаются в базе
+    incremental = True
+    KEY_COLUMNS = ['source_file', 'Sheet', 'Block', 'Group', 'col_start']
+    INDEXED_COLUMNS = ['Date', 'Furnace', 'Template']
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.rows = 0
+        self.connection = sqlite3.connect(output_file)
+        try:
+            table = quote_identifier(self.TABLE)
+            key = ', '.join(quote_identifier(column) for column in self.KEY_COLUMNS)
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                f"source_file TEXT NOT NULL, Sheet TEXT NOT NULL, Block INTEGER NOT NULL, "
+                f"\"Group\" INTEGER NOT NULL, col_start INTEGER NOT NULL, "
+                f"Date, Furnace TEXT, Template TEXT, run_id INTEGER, PRIMARY KEY ({key}))"
+            )
+            for column in self.INDEXED_COLUMNS:
+                self.connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS {quote_identifier(f'idx_{self.TABLE}_{column}')} "
+                    f"ON {table} ({quote_identifier(column)})"
+                )
+            # Имена столбцов в SQLite не различают регистр
+            self.table_columns = {
+                row[1].casefold(): row[1]
+                for row in self.connection.execute(f"PRAGMA table_info({table})")
+            }
+            # Номер запуска: по нему находятся строки файла, не обновленные этим запуском
+            self.run_id = self.connection.execute(
+                f"SELECT COALESCE(MAX(run_id), 0) + 1 FROM {table}"
+            ).fetchone()[0]
+        except Exception:
+            self.connection.close()
+            raise
+
+    def column_for(self, name):
+        """Столбец таблицы для ключа строки; новый столбец добавляется в таблицу"""
+        column = self.table_columns.get(name.casefold())
+        if column is None:
+            self.connection.execute(
+                f"ALTER TABLE {quote_identifier(self.TABLE)} ADD COLUMN {quote_identifier(name)}"
+            )
+            column = self.table_columns[name.casefold()] = name
+        return column
+
+    def write_rows(self, rows, input_file=None, complete=True):
+        """Обновляет строки одного файла.
+
+        complete - файл разобран без ошибок: прежние строки файла, которых нет в rows,
+        удаляются (и все его строки, если rows пуст). Иначе строки только добавляются
+        """
+        source_file = os.path.abspath(input_file) if input_file else ''
+        table = quote_identifier(self.TABLE)
+
+        # Строки с одинаковым набором столбцов вставляются одним executemany
+        batches = {}
+        for row in rows:
+            values = {'source_file': source_file, 'col_start': row.get(COL_START_KEY), 'run_id': self.run_id}
+            for name, value in row.items():
+                if not name.startswith('_'):
+                    values[self.column_for(name)] = sqlite_value(value)
+            batches.setdefault(tuple(values), []).append(tuple(values.values()))
+
+        for columns, batch in batches.items():
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(map(quote_identifier, columns))}) "
+                f"VALUES ({', '.join('?' * len(columns))})",
+                batch
+            )
+        if complete:
+            self.connection.execute(
+                f"DELETE FROM {table} WHERE source_file = ? AND run_id <> ?", (source_file, self.run_id)
+            )
+        self.rows += len(rows)
+
+    def has_file(self, input_file):
+        """Есть ли в базе строки файла (в новой или очищенной базе их нет)"""
+        return self.connection.execute(
+            f"SELECT 1 FROM {quote_identifier(self.TABLE)} WHERE source_file = ? LIMIT 1",
+            (os.path.abspath(input_file),)
+        ).fetchone() is not None
+
+    def remove_file(self, input_file):
+        """Удаляет строки файла (файл удален из директории)"""
+        self.connection.execute(
+            f"DELETE FROM {quote_identifier(self.TABLE)} WHERE source_file = ?", (os.path.abspath(input_file),)
+        )
+
+    def close(self):
+        """Фиксирует транзакцию запуска и возвращает столбцы таблицы"""
+        try:
+            self.connection.commit()
+        finally:
+            self.connection.close()
+        return list(self.table_columns.values())
+
+    def abort(self):
+        """Откатывает все изменения запуска"""
+        self.connection.rollback()
+        self.connection.close()
+
+# Расширения файлов базы SQLite
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+
+def open_sink(output_file):
+    """Открывает запись результатов по расширению выходного файла (.csv, .sqlite/.db или .xlsx)"""
+    if output_file.lower().endswith('.csv'):
+        return CsvSink(output_file)
+    if output_file.lower().endswith(SQLITE_EXTENSIONS):
+        return SqliteSink(output_file)
+    return ExcelSink(output_file)
+
+def close_sink(sink, template_manager, log=print, profile=None):
+    """Завершает запись: пишет выходной файл или сообщает, что данных нет.
+
+    Время записи и размер файла добавляются в profile (RunProfile), если он передан
+    """
+    if not sink.rows:
+        if sink.incremental:
+            # Удаления строк файлов, переставших давать данные, тоже нужно зафиксировать
+            sink.close()
+        else:
+            sink.abort()
+        log("No rows were written." if sink.incremental else "No data was extracted.")
+        return
+
+    started = time.perf_counter()
+    columns = sink.close()
+    if profile is not None:
+        profile.add_export(time.perf_counter() - started, bytes_written=os.path.getsize(sink.output_file))
+    log(f"Data successfully saved to {sink.output_file}")
+    log(f"Total rows: {sink.rows}")
+    log(f"Total columns: {len(columns)}")
+    log(f"Total templates in library: {len(template_manager.templates)}")
@@ -0,0 +1,114 @@
+import os
+import csv
+import json
+import time
+import cProfile
+from collections import Counter
+
+# Этапы разбора в порядке выполнения
+STAGES = ['open', 'load', 'snapshot', 'segmentation', 'group_analysis', 'matching',
+          'extraction', 'template_creation', 'export']
+
+def same_file(target, input_file):
+    """Файл совпадает с выбранным: по полному пути или, если путь не указан, по имени"""
+    if os.path.dirname(target):
+        return os.path.normcase(os.path.abspath(target)) == os.path.normcase(os.path.abspath(input_file))
+    return os.path.basename(input_file) == target
+
+def call_profiled(output_file, func, *args):
+    """Выполняет func под cProfile и сохраняет статистику в output_file"""
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args)
+    finally:
+        profiler.dump_stats(output_file)
+
+class RunProfile:
+    """Время этапов и счетчики обработки: по файлам, по листам и в сумме.
+
+    Записи файлов приходят из ExcelProcessor.file_profile (в том числе из рабочих
+    процессов), время и объем записи результата - из close_sink
+    """
+    def __init__(self, cprofile_file=None, cprofile_output="greentable.prof"):
+        self.files = []
+        self.export = Counter()
+        # Файл, разбор которого снимается cProfile целиком
+        self.cprofile_file = cprofile_file
+        self.cprofile_output = cprofile_output
+        self.start_time = time.perf_counter()
+
+    @property
+    def cprofile(self):
+        """(файл, куда сохранить статистику) для ExcelProcessor или None"""
+        if self.cprofile_file:
+            return (self.cprofile_file, self.cprofile_output)
+        return None
+
+    def add_file(self, record, ok=True, rows=0):
+        """Добавляет профиль разобранного файла и число строк, которые он дал"""
+        record = dict(record, ok=ok)
+        record['counters'] = dict(record['counters'], rows=rows)
+        self.files.append(record)
+
+    def add_cached_file(self, input_file, rows):
+        self.files.append({'file': input_file, 'cached': True, 'counters': {'rows': rows}, 'sheets': []})
+
+    def add_export(self, seconds, rows=0, bytes_written=0):
+        self.export['seconds'] += seconds
+        self.export['rows'] += rows
+        self.export['bytes_written'] += bytes_written
+
+    @staticmethod
+    def file_totals(record):
+        """Сумма этапов и счетчиков по листам файла"""
+        stages = Counter(record.get('stages', {}))
+        counters = Counter(record.get('counters', {}))
+        for sheet in record['sheets']:
+            stages.update(sheet['stages'])
+            counters.update(sheet['counters'])
+        return stages, counters
+
+    def report(self):
+        stages = Counter()
+        counters = Counter()
+        files = []
+        for record in self.files:
+            file_stages, file_counters = self.file_totals(record)
+            stages.update(file_stages)
+            counters.update(file_counters)
+            counters['cached_files' if record.get('cached') else 'parsed_files'] += 1
+            files.append(dict(record, stages=dict(file_stages), counters=dict(file_counters)))
+        stages['export'] += self.export['seconds']
+        counters['bytes_written'] += self.export['bytes_written']
+
+        return {
+            'elapsed': round(time.perf_counter() - self.start_time, 6),
+            'totals': {
+                'stages': {stage: round(stages[stage], 6) for stage in STAGES if stage in stages},
+                'counters': dict(counters),
+            },
+            'files': files,
+        }
+
+    def save(self, output_file):
+        """Сохраняет отчет в JSON или, для .csv, таблицей: строка на лист, на файл и итог"""
+        report = self.report()
+        if not output_file.lower().endswith('.csv'):
+            with open(output_file, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            return
+
+        rows = []
+        for record in report['files']:
+            for sheet in record['sheets']:
+                rows.append(dict(sheet['stages'], **sheet['counters'], file=record['file'], sheet=sheet['sheet']))
+            rows.append(dict(record['stages'], **record['counters'], file=record['file'], sheet='*'))
+        totals = report['totals']
+        rows.append(dict(totals['stages'], **totals['counters'], file='*', sheet='*'))
+
+        counter_names = sorted({name for row in rows for name in row} - set(STAGES) - {'file', 'sheet'})
+        columns = ['file', 'sheet'] + STAGES + counter_names
+        with open(output_file, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns, delimiter=';', restval=0)
+            writer.writeheader()
+            writer.writerows(rows)
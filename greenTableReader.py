@@ -0,0 +1,444 @@
+import os
+import re
+import zipfile
+import hashlib
+import posixpath
+from collections import namedtuple
+from xml.etree.ElementTree import iterparse, fromstring
+from openpyxl import load_workbook
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+from openpyxl.utils.cell import coordinate_to_tuple, range_boundaries
+from openpyxl.utils.datetime import from_excel, from_ISO8601, WINDOWS_EPOCH, CALENDAR_MAC_1904
+
+try:
+    import xlrd
+except ImportError:
+    xlrd = None
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+ROW_TAG = MAIN_NS + 'row'
+CELL_TAG = MAIN_NS + 'c'
+VALUE_TAG = MAIN_NS + 'v'
+TEXT_TAG = MAIN_NS + 't'
+RUN_TAG = MAIN_NS + 'r'
+INLINE_STRING_TAG = MAIN_NS + 'is'
+MERGE_TAG = MAIN_NS + 'mergeCell'
+
+# Целые значения <v> и индексы стилей s="..." в XML листа (для ключа содержимого листа)
+INTEGER_VALUE_RE = re.compile(rb'<(?:[\w.-]+:)?v\b[^>]*>\s*(\d+)\s*<')
+STYLE_INDEX_RE = re.compile(rb'\ss=["\'](\d+)["\']')
+
+# Диапазон объединения с теми же полями, что у CellRange openpyxl
+MergedRange = namedtuple('MergedRange', 'min_row min_col max_row max_col')
+
+class SheetData:
+    """Лист в виде, нужном для разбора: значения, объединения и залитые ячейки"""
+    def __init__(self, rows, max_row, max_col, merged_ranges, filled):
+        self.rows = rows                    # max_row списков по max_col значений
+        self.max_row = max_row
+        self.max_col = max_col
+        self.merged_ranges = merged_ranges
+        self.filled = filled                # (row, col) ячеек с заливкой
+
+    def is_filled(self, row, col):
+        return (row, col) in self.filled
+
+def openpyxl_fill_is_set(fill):
+    """Проверка fill.start_color.index != '00000000'; у градиентной заливки start_color нет - это заливка"""
+    start_color = getattr(fill, 'start_color', None)
+    if start_color is None:
+        return True
+    return start_color.index != '00000000'
+
+class OpenpyxlSheet:
+    """Лист полной книги openpyxl с тем же интерфейсом, что у SheetData.
+
+    filled_styles - общий для книги признак заливки по номеру стиля ячейки (style_id)
+    """
+    def __init__(self, sheet, filled_styles):
+        self.sheet = sheet
+        self.filled_styles = filled_styles
+        self.max_row = sheet.max_row
+        self.max_col = sheet.max_column
+        self.merged_ranges = sheet.merged_cells.ranges
+        self.rows = [
+            list(row) for row in sheet.iter_rows(
+                min_row=1, max_row=self.max_row, min_col=1, max_col=self.max_col, values_only=True
+            )
+        ]
+
+    def is_filled(self, row, col):
+        # Ячейки используемой области уже созданы чтением значений - cell() новых не добавляет.
+        # Стилей в книге немного: заливка проверяется один раз на стиль
+        cell = self.sheet.cell(row=row, column=col)
+        style_id = cell.style_id
+        filled = self.filled_styles.get(style_id)
+        if filled is None:
+            filled = self.filled_styles[style_id] = openpyxl_fill_is_set(cell.fill)
+        return filled
+
+class OpenpyxlWorkbook:
+    """Книга, загруженная openpyxl целиком (объединения и заливка доступны только так)"""
+    def __init__(self, filename):
+        # ВСЕГДА используем data_only=True (игнорируем формулы)
+        self.workbook = load_workbook(filename=filename, data_only=True)
+        self.sheetnames = self.workbook.sheetnames
+        # Номер стиля -> есть ли заливка; заполняется по мере обращения
+        self.filled_styles = {}
+
+    def __getitem__(self, sheet_name):
+        return OpenpyxlSheet(self.workbook[sheet_name], self.filled_styles)
+
+    def close(self):
+        self.workbook.close()
+
+def text_content(element):
+    """Текст строки без форматирования: <t> и <t> всех фрагментов <r> (фонетика <rPh> не входит)"""
+    parts = []
+    for child in element:
+        if child.tag == TEXT_TAG:
+            parts.append(child.text or '')
+        elif child.tag == RUN_TAG:
+            text = child.find(TEXT_TAG)
+            if text is not None:
+                parts.append(text.text or '')
+    return ''.join(parts)
+
+def fill_is_set(fill):
+    """Повторяет проверку fill.start_color.index != '00000000' для заливки из styles.xml"""
+    pattern = fill.find(MAIN_NS + 'patternFill')
+    if pattern is None:
+        # Градиентная заливка
+        return fill.find(MAIN_NS + 'gradientFill') is not None
+    color = pattern.find(MAIN_NS + 'fgColor')
+    if color is None:
+        return False
+    # Индексированный, тематический и автоматический цвет - всегда заливка
+    if color.get('indexed') is not None or color.get('theme') is not None or color.get('auto') is not None:
+        return True
+    rgb = color.get('rgb', '00000000')
+    if len(rgb) == 6:
+        rgb = '00' + rgb
+    return rgb != '00000000'
+
+class XlsxWorkbook:
+    """Потоковое чтение .xlsx прямо из zip.
+
+    Лист разбирается iterparse по строкам: значения (с общими строками и датами
+    по числовым форматам), <mergeCell> и индексы стилей, сопоставленные с заливками
+    styles.xml. Объекты ячеек и стилей openpyxl не создаются. Результат совпадает
+    с load_workbook(data_only=True) в том, что нужно разбору.
+    """
+    def __init__(self, filename):
+        self.archive = zipfile.ZipFile(filename)
+        try:
+            workbook_part = self.find_workbook_part()
+            rels = self.read_rels(workbook_part)
+            root = fromstring(self.archive.read(workbook_part))
+
+            properties = root.find(MAIN_NS + 'workbookPr')
+            date1904 = properties is not None and properties.get('date1904') in ('1', 'true')
+            self.epoch = CALENDAR_MAC_1904 if date1904 else WINDOWS_EPOCH
+
+            # Листы в порядке книги; листы-диаграммы данных не содержат
+            self.sheet_parts = {}
+            self.sheetnames = []
+            for sheet in root.iter(MAIN_NS + 'sheet'):
+                rel_type, target = rels[sheet.get(REL_NS + 'id')]
+                if rel_type.endswith('/worksheet'):
+                    self.sheetnames.append(sheet.get('name'))
+                    self.sheet_parts[sheet.get('name')] = target
+
+            parts = {rel_type.rsplit('/', 1)[-1]: target for rel_type, target in rels.values()}
+            self.shared_strings = self.read_shared_strings(parts.get('sharedStrings'))
+            self.read_styles(parts.get('styles'))
+        except Exception:
+            self.archive.close()
+            raise
+
+    def find_workbook_part(self):
+        for rel_type, target in self.read_rels('').values():
+            if rel_type.endswith('/officeDocument'):
+                return target
+        return 'xl/workbook.xml'
+
+    def read_rels(self, part):
+        """Связи части пакета: id -> (тип, путь внутри архива)"""
+        folder, name = posixpath.split(part)
+        rels_part = posixpath.join(folder, '_rels', name + '.rels')
+        if rels_part not in self.archive.namelist():
+            return {}
+        rels = {}
+        for rel in fromstring(self.archive.read(rels_part)).iter(PKG_REL_NS + 'Relationship'):
+            target = rel.get('Target')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(folder, target))
+            rels[rel.get('Id')] = (rel.get('Type'), target)
+        return rels
+
+    def read_shared_strings(self, part):
+        strings = []
+        if part is None:
+            return strings
+        with self.archive.open(part) as source:
+            for _, element in iterparse(source):
+                if element.tag == MAIN_NS + 'si':
+                    strings.append(text_content(element).replace('x005F_', ''))
+                    element.clear()
+        return strings
+
+    def read_styles(self, part):
+        """Индексы стилей ячеек (cellXfs) с заливкой, датой и интервалом времени"""
+        self.filled_styles = set()
+        self.date_styles = set()
+        self.timedelta_styles = set()
+        if part is None:
+            return
+        root = fromstring(self.archive.read(part))
+
+        custom_formats = {}
+        num_fmts = root.find(MAIN_NS + 'numFmts')
+        if num_fmts is not None:
+            for num_fmt in num_fmts:
+                custom_formats[int(num_fmt.get('numFmtId'))] = num_fmt.get('formatCode')
+
+        fills = []
+        fills_element = root.find(MAIN_NS + 'fills')
+        if fills_element is not None:
+            fills = [fill_is_set(fill) for fill in fills_element]
+
+        cell_xfs = root.find(MAIN_NS + 'cellXfs')
+        if cell_xfs is None:
+            return
+        for idx, xf in enumerate(cell_xfs):
+            fill_id = int(xf.get('fillId', 0))
+            if fill_id < len(fills) and fills[fill_id]:
+                self.filled_styles.add(idx)
+
+            num_fmt_id = int(xf.get('numFmtId', 0))
+            fmt = custom_formats.get(num_fmt_id, BUILTIN_FORMATS.get(num_fmt_id))
+            if is_date_format(fmt):
+                self.date_styles.add(idx)
+            if is_timedelta_format(fmt):
+                self.timedelta_styles.add(idx)
+
+    def cell_value(self, element, style_id):
+        """Значение ячейки так же, как его отдает openpyxl с data_only=True"""
+        data_type = element.get('t', 'n')
+        if data_type == 'inlineStr':
+            child = element.find(INLINE_STRING_TAG)
+            return None if child is None else text_content(child)
+
+        value = element.findtext(VALUE_TAG) or None
+        if value is None:
+            return None
+        if data_type == 'n':
+            value = float(value) if ('.' in value or 'E' in value or 'e' in value) else int(value)
+            if style_id in self.date_styles:
+                try:
+                    return from_excel(value, self.epoch, timedelta=style_id in self.timedelta_styles)
+                except (OverflowError, ValueError):
+                    return '#VALUE!'
+            return value
+        if data_type == 's':
+            return self.shared_strings[int(value)]
+        if data_type == 'b':
+            return bool(int(value))
+        if data_type == 'd':
+            return from_ISO8601(value)
+        # str (результат формулы) и e (ошибка) остаются строками
+        return value
+
+    def sheet_key(self, sheet_name):
+        """Хеш всего, от чего зависит разобранный лист, без разбора XML.
+
+        Кроме имени и XML листа учитываются общие строки, на которые он может ссылаться
+        (строки по всем целым <v>, с запасом), и признаки заливки и формата даты его стилей:
+        одинаковый ключ значит одинаковый лист и в разных книгах
+        """
+        data = self.archive.read(self.sheet_parts[sheet_name])
+        digest = hashlib.sha1()
+        digest.update(sheet_name.encode('utf-8') + b'\0')
+        digest.update(b'1904' if self.epoch is CALENDAR_MAC_1904 else b'1900')
+        digest.update(data)
+        for index in sorted({int(value) for value in INTEGER_VALUE_RE.findall(data)}):
+            if index < len(self.shared_strings):
+                digest.update(f"\0{index}:{self.shared_strings[index]}".encode('utf-8'))
+        for style_id in sorted({0} | {int(value) for value in STYLE_INDEX_RE.findall(data)}):
+            flags = (style_id in self.filled_styles, style_id in self.date_styles, style_id in self.timedelta_styles)
+            digest.update(f"\0{style_id}:{flags}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def __getitem__(self, sheet_name):
+        cells = {}
+        filled = set()
+        merged_ranges = []
+        row_counter = 0
+
+        with self.archive.open(self.sheet_parts[sheet_name]) as source:
+            for _, element in iterparse(source):
+                tag = element.tag
+                if tag == ROW_TAG:
+                    row_number = element.get('r')
+                    row_counter = int(float(row_number)) if row_number else row_counter + 1
+                    col_counter = 0
+                    for cell in element:
+                        if cell.tag != CELL_TAG:
+                            continue
+                        coordinate = cell.get('r')
+                        if coordinate:
+                            row, col = coordinate_to_tuple(coordinate)
+                            col_counter = col
+                        else:
+                            col_counter += 1
+                            row, col = row_counter, col_counter
+                        style_id = int(cell.get('s', 0))
+                        cells[row, col] = self.cell_value(cell, style_id)
+                        if style_id in self.filled_styles:
+                            filled.add((row, col))
+                    element.clear()
+                elif tag == MERGE_TAG:
+                    min_col, min_row, max_col, max_row = range_boundaries(element.get('ref'))
+                    merged_ranges.append(MergedRange(min_row, min_col, max_row, max_col))
+
+        # Как в openpyxl: ячейки объединений входят в размеры листа,
+        # а все, кроме левой верхней, теряют свой стиль
+        max_row = max((row for row, col in cells), default=1)
+        max_col = max((col for row, col in cells), default=1)
+        for merged_range in merged_ranges:
+            max_row = max(max_row, merged_range.max_row)
+            max_col = max(max_col, merged_range.max_col)
+            for r in range(merged_range.min_row, merged_range.max_row + 1):
+                for c in range(merged_range.min_col, merged_range.max_col + 1):
+                    if (r, c) != (merged_range.min_row, merged_range.min_col):
+                        filled.discard((r, c))
+                        cells.pop((r, c), None)
+
+        rows = [[None] * max_col for _ in range(max_row)]
+        for (row, col), value in cells.items():
+            rows[row - 1][col - 1] = value
+        return SheetData(rows, max_row, max_col, merged_ranges, filled)
+
+    def close(self):
+        self.archive.close()
+
+class XlsWorkbook:
+    """Чтение .xls (BIFF) через xlrd; объединения и заливка берутся из formatting_info"""
+    def __init__(self, filename):
+        if xlrd is None:
+            raise ImportError("xlrd is required to read .xls files (pip install xlrd)")
+        self.book = xlrd.open_workbook(filename, formatting_info=True, on_demand=True)
+        self.sheetnames = self.book.sheet_names()
+        self.epoch = CALENDAR_MAC_1904 if self.book.datemode else WINDOWS_EPOCH
+
+        # Стили с узором заливки и форматом интервала времени
+        self.filled_styles = set()
+        self.timedelta_styles = set()
+        for idx, xf in enumerate(self.book.xf_list):
+            if xf.background.fill_pattern:
+                self.filled_styles.add(idx)
+            fmt = self.book.format_map.get(xf.format_key)
+            if fmt is not None and is_timedelta_format(fmt.format_str):
+                self.timedelta_styles.add(idx)
+
+    def cell_value(self, cell_type, value, style_id):
+        if cell_type in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+            return None
+        if cell_type == xlrd.XL_CELL_NUMBER:
+            # В BIFF все числа float; целые приводим к int, как их отдает .xlsx
+            return int(value) if value.is_integer() else value
+        if cell_type == xlrd.XL_CELL_DATE:
+            try:
+                return from_excel(value, self.epoch, timedelta=style_id in self.timedelta_styles)
+            except (OverflowError, ValueError):
+                return '#VALUE!'
+        if cell_type == xlrd.XL_CELL_BOOLEAN:
+            return bool(value)
+        if cell_type == xlrd.XL_CELL_ERROR:
+            return xlrd.error_text_from_code.get(value, '#VALUE!')
+        return value
+
+    def __getitem__(self, sheet_name):
+        sheet = self.book.sheet_by_name(sheet_name)
+        merged_ranges = [
+            MergedRange(rlo + 1, clo + 1, rhi, chi)
+            for rlo, rhi, clo, chi in sheet.merged_cells
+        ]
+        max_row = max([sheet.nrows] + [r.max_row for r in merged_ranges]) or 1
+        max_col = max([sheet.ncols] + [r.max_col for r in merged_ranges]) or 1
+
+        rows = [[None] * max_col for _ in range(max_row)]
+        filled = set()
+        for r in range(sheet.nrows):
+            row = rows[r]
+            for c, (cell_type, value) in enumerate(zip(sheet.row_types(r), sheet.row_values(r))):
+                style_id = sheet.cell_xf_index(r, c)
+                row[c] = self.cell_value(cell_type, value, style_id)
+                if style_id in self.filled_styles:
+                    filled.add((r + 1, c + 1))
+
+        # Как и для .xlsx, заливка объединения - только у левой верхней ячейки
+        for merged_range in merged_ranges:
+            for r in range(merged_range.min_row, merged_range.max_row + 1):
+                for c in range(merged_range.min_col, merged_range.max_col + 1):
+                    if (r, c) != (merged_range.min_row, merged_range.min_col):
+                        filled.discard((r, c))
+
+        self.book.unload_sheet(sheet_name)
+        return SheetData(rows, max_row, max_col, merged_ranges, filled)
+
+    def close(self):
+        self.book.release_resources()
+
+# Читатели книг. Книга дает sheetnames, book[имя] -> лист и close();
+# лист - rows (значения max_row x max_col), max_row, max_col,
+# merged_ranges (min_row, min_col, max_row, max_col) и is_filled(row, col)
+OLE_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+ZIP_SIGNATURE = b'PK\x03\x04'
+
+def is_biff_file(filename):
+    """Файл .xls (BIFF в контейнере OLE) по сигнатуре"""
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(8) == OLE_SIGNATURE
+    except OSError:
+        return False
+
+def sheet_keys(filename):
+    """Ключи содержимого листов .xlsx по порядку книги: [(имя, ключ), ...].
+
+    Для .xls, книг, которые не читает потоковый читатель, и нечитаемых файлов - пустой список
+    """
+    try:
+        with open(filename, 'rb') as f:
+            if not f.read(4).startswith(ZIP_SIGNATURE):
+                return []
+        workbook = XlsxWorkbook(filename)
+    except Exception:
+        return []
+    try:
+        return [(sheet_name, workbook.sheet_key(sheet_name)) for sheet_name in workbook.sheetnames]
+    except Exception:
+        return []
+    finally:
+        workbook.close()
+
+def open_workbook(filename, log=print):
+    """Открывает книгу читателем по ее содержимому (.xls - BIFF, .xlsx - zip), а не по расширению"""
+    with open(filename, 'rb') as f:
+        signature = f.read(8)
+    if signature == OLE_SIGNATURE:
+        return XlsWorkbook(filename)
+    if not signature.startswith(ZIP_SIGNATURE) and os.path.splitext(filename)[1].lower() == '.xls':
+        raise ValueError("Unsupported .xls file: neither a BIFF nor an .xlsx workbook")
+
+    try:
+        return XlsxWorkbook(filename)
+    except Exception as e:
+        log(f"  Streaming reader failed ({str(e)}), loading with openpyxl")
+        return OpenpyxlWorkbook(filename)
@@ -0,0 +1,134 @@
+import sys
+import os
+import json
+from collections import Counter
+from greenTableCache import ResultCache
+
+# Сколько мест групп без шаблона запоминается на ключ (в файле и в сводке)
+MISS_SAMPLES = 5
+
+class MatchTelemetry:
+    """Какие шаблоны дают строки и какие fingerprint шаблона не находят.
+
+    Хранится по файлам (telemetry.json в директории кеша): разобранный заново файл
+    заменяет свою запись, у файла из кеша остаются прежние промахи. Сводка по всем
+    файлам пишется в match_report.json при каждом сохранении
+    """
+    def __init__(self, cache_dir=".greentable_cache"):
+        self.cache_dir = cache_dir
+        self.telemetry_file = os.path.join(cache_dir, "telemetry.json")
+        self.report_file = os.path.join(cache_dir, "match_report.json")
+        # Ключ файла -> {'path', 'hits': id шаблона -> строк, 'misses': [[лист, fingerprint, увнк, групп, id созданного шаблона, места]]}
+        self.entries = {}
+        self.run_files = set()
+        self.load()
+
+    def load(self):
+        try:
+            if os.path.exists(self.telemetry_file):
+                with open(self.telemetry_file, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f).get('files', {})
+        except Exception as e:
+            print(f"Error loading match telemetry: {e}", file=sys.stderr)
+            self.entries = {}
+
+    def add_file(self, input_file, rows, misses=None):
+        """Записывает результат файла: строки по шаблонам и промахи ((лист, fingerprint, увнк) -> промах).
+
+        misses None - файл взят из кеша, его промахи остаются прежними
+        """
+        key = ResultCache.cache_key(input_file)
+        hits = Counter(row['Template'] for row in rows if row.get('Template') is not None)
+        if misses is None:
+            entry = self.entries.get(key)
+            stored_misses = entry['misses'] if entry else []
+        else:
+            stored_misses = [
+                [sheet_name, fingerprint, has_uvnk, miss['count'], miss['template'], miss['samples']]
+                for (sheet_name, fingerprint, has_uvnk), miss in misses.items()
+            ]
+        self.entries[key] = {'path': input_file, 'hits': dict(hits), 'misses': stored_misses}
+        self.run_files.add(key)
+
+    def report(self, template_manager=None):
+        """Сводка по всем файлам: шаблоны по числу строк и ключи без шаблона по числу групп"""
+        hits = Counter()
+        template_files = Counter()
+        misses = {}
+        for entry in self.entries.values():
+            for template_id, count in entry['hits'].items():
+                hits[template_id] += count
+                template_files[template_id] += 1
+            for sheet_name, fingerprint, has_uvnk, count, template_id, samples in entry['misses']:
+                miss = misses.setdefault((sheet_name, fingerprint, has_uvnk), {
+                    'sheet': sheet_name,
+                    'fingerprint': fingerprint,
+                    'has_uvnk': has_uvnk,
+                    'groups': 0,
+                    'files': 0,
+                    'created_templates': [],
+                    'samples': [],
+                })
+                miss['groups'] += count
+                miss['files'] += 1
+                if template_id is not None and template_id not in miss['created_templates']:
+                    miss['created_templates'].append(template_id)
+                for sample in samples[:MISS_SAMPLES - len(miss['samples'])]:
+                    miss['samples'].append(dict(sample, file=entry['path']))
+
+        # Шаблоны библиотеки, включая те, что не дали ни одной строки, - в порядке библиотеки
+        templates = []
+        known = set()
+        for template in (template_manager.templates if template_manager is not None else []):
+            known.add(template['id'])
+            templates.append({
+                'id': template['id'],
+                'name': template.get('name', ''),
+                'sheet': template['sheet'],
+                'rows': hits[template['id']],
+                'files': template_files[template['id']],
+            })
+        for template_id in hits:
+            if template_id not in known:
+                # Шаблона нет в библиотеке (удален), а строки файлов из кеша на него ссылаются
+                templates.append({'id': template_id, 'name': None, 'sheet': None, 'rows': hits[template_id],
+                                  'files': template_files[template_id], 'missing': template_manager is not None})
+        templates.sort(key=lambda t: -t['rows'])
+
+        # Созданный по промаху шаблон показывает, сколько строк дал этот fingerprint потом
+        miss_list = list(misses.values())
+        for miss in miss_list:
+            miss['created_rows'] = sum(hits[template_id] for template_id in miss['created_templates'])
+        miss_list.sort(key=lambda m: (-m['groups'], -m['created_rows']))
+
+        return {
+            'files': len(self.entries),
+            'files_this_run': len(self.run_files),
+            'rows': sum(hits.values()),
+            'missed_groups': sum(miss['groups'] for miss in miss_list),
+            'unused_templates': sum(1 for t in templates if t['rows'] == 0),
+            'templates': templates,
+            'misses': miss_list,
+        }
+
+    def save_report(self, path, template_manager=None):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(template_manager), f, ensure_ascii=False, indent=2)
+
+    def save(self, template_manager=None):
+        """Атомарно сохраняет записи файлов и сводку; записи удаленных файлов отбрасываются"""
+        if not self.entries and not os.path.exists(self.telemetry_file):
+            return True
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for key in [k for k in self.entries if not os.path.exists(k)]:
+                del self.entries[key]
+            tmp_file = self.telemetry_file + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'files': self.entries}, f, ensure_ascii=False)
+            os.replace(tmp_file, self.telemetry_file)
+            self.save_report(self.report_file, template_manager)
+            return True
+        except Exception as e:
+            print(f"Error saving match telemetry: {e}", file=sys.stderr)
+            return False
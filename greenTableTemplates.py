@@ -0,0 +1,499 @@
+import sys
+import os
+import json
+import time
+from collections import defaultdict
+
+# После стольких записей в журнале шаблоны переписываются целиком
+JOURNAL_COMPACT_THRESHOLD = 200
+
+# Поля ячеек, которые нужны только для показа в редакторе
+EXAMPLE_FIELDS = ('example', 'absolute_position')
+
+class TemplateManager:
+    def __init__(self, template_file="templates.json", templates=None):
+        self.template_file = template_file  # По умолчанию в папке программы
+        # Журнал изменений, еще не записанных в template_file
+        self.journal_file = self.template_file + ".journal"
+        # Примеры значений ячеек, вынесенные из библиотеки; читаются при первом обращении
+        self.examples_file = os.path.splitext(self.template_file)[0] + ".examples.json"
+        self.examples = None
+        self.journal_entries = 0
+        self.dirty = False
+        # Библиотека, переданная списком (например, в рабочий процесс),
+        # живет только в памяти и на диск не пишется
+        self.persist = templates is None
+        self.templates = []
+        # (fingerprint, has_uvnk) -> шаблоны в порядке библиотеки
+        self.template_index = defaultdict(list)
+        # id шаблона -> план извлечения
+        self.extraction_plans = {}
+        # Расположение ячеек группы -> номер; компактный fingerprint - (номер, маска required)
+        self.layout_ids = {}
+        self.layouts = []
+        # Размер и время изменения файла шаблонов и журнала на момент последнего чтения или записи
+        self.disk_state = None
+        # Ошибка чтения библиотеки (None - библиотека загружена или создана)
+        self.load_error = None
+        if self.persist:
+            self.load_templates()
+        else:
+            self.templates = templates
+            self.rebuild_index()
+        
+    def load_templates(self):
+        """Загружает шаблоны из JSON файла в папке программы"""
+        try:
+            if os.path.exists(self.template_file):
+                with open(self.template_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                    self.templates = data.get('templates', [])
+            else:
+                # Создаем пустой файл с шаблонами
+                self.dirty = True
+            
+            # Доигрываем изменения, которые не успели попасть в файл
+            if self.replay_journal():
+                self.dirty = True
+            
+            self.rebuild_index()
+            if self.dirty:
+                self.save_templates()
+            self.disk_state = self.file_state()
+            return True
+        except Exception as e:
+            print(f"Error loading templates: {e}", file=sys.stderr)
+            self.load_error = str(e)
+            # Пустая библиотека в памяти не должна затереть нечитаемый файл на диске
+            self.persist = False
+            self.templates = []
+            self.rebuild_index()
+            return False
+    
+    def save_templates(self):
+        """Атомарно сохраняет шаблоны в JSON файл и очищает журнал"""
+        if not self.persist:
+            return True
+        try:
+            # Пишем во временный файл и подменяем им основной,
+            # чтобы сбой во время записи не испортил библиотеку
+            tmp_file = self.template_file + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({"templates": self.templates}, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.template_file)
+            
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+            self.journal_entries = 0
+            self.dirty = False
+            self.disk_state = self.file_state()
+            return True
+        except Exception as e:
+            print(f"Error saving templates: {e}", file=sys.stderr)
+            return False
+    
+    def flush(self):
+        """Записывает накопленные изменения шаблонов в JSON файл"""
+        if self.dirty:
+            return self.save_templates()
+        return True
+    
+    def write_journal(self, record):
+        """Дописывает изменение в журнал вместо перезаписи всего файла"""
+        if not self.persist:
+            return
+        self.dirty = True
+        try:
+            with open(self.journal_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.journal_entries += 1
+            self.disk_state = self.file_state()
+        except Exception as e:
+            print(f"Error writing template journal: {e}", file=sys.stderr)
+            self.save_templates()
+            return
+        
+        # Периодически сворачиваем журнал в основной файл
+        if self.journal_entries >= JOURNAL_COMPACT_THRESHOLD:
+            self.save_templates()
+    
+    def replay_journal(self):
+        """Применяет записи журнала к загруженным шаблонам, возвращает их количество"""
+        if not os.path.exists(self.journal_file):
+            return 0
+        
+        known_ids = {t['id'] for t in self.templates}
+        applied = 0
+        with open(self.journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Оборванная запись в конце журнала после сбоя
+                    break
+                
+                # Записи применяются идемпотентно: журнал мог остаться
+                # после сбоя уже после сохранения основного файла
+                if record.get('op') == 'create':
+                    template = record['template']
+                    if template['id'] not in known_ids:
+                        self.templates.append(template)
+                        known_ids.add(template['id'])
+                elif record.get('op') == 'update':
+                    for template in self.templates:
+                        if template['id'] == record['id']:
+                            template.update(record['updates'])
+                            break
+                applied += 1
+        return applied
+    
+    def file_state(self):
+        """(размер, mtime) файла шаблонов и журнала; None для отсутствующего файла"""
+        state = []
+        for path in (self.template_file, self.journal_file):
+            try:
+                stat = os.stat(path)
+                state.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                state.append(None)
+        return tuple(state)
+    
+    def reload_changed(self):
+        """Перечитывает библиотеку, если файл шаблонов или журнал изменил другой процесс.
+        
+        Неизмененные шаблоны остаются прежними объектами, индекс перестраивается
+        только для затронутых ключей. Возвращает id добавленных, измененных и удаленных шаблонов
+        """
+        if not self.persist:
+            return []
+        state = self.file_state()
+        if state == self.disk_state:
+            return []
+        
+        try:
+            templates = []
+            if os.path.exists(self.template_file):
+                with open(self.template_file, 'r', encoding='utf-8') as f:
+                    templates = json.load(f).get('templates', [])
+        except (OSError, ValueError) as e:
+            print(f"Error reloading templates: {e}", file=sys.stderr)
+            return []
+        
+        old_templates = self.templates
+        old_by_id = {t['id']: t for t in old_templates}
+        self.templates = templates
+        self.journal_entries = self.replay_journal()
+        self.disk_state = state
+        self.templates = [
+            old_by_id[t['id']] if old_by_id.get(t['id']) == t else t
+            for t in self.templates
+        ]
+        
+        new_by_id = {t['id']: t for t in self.templates}
+        changed = [t['id'] for t in self.templates if old_by_id.get(t['id']) is not t]
+        changed.extend(template_id for template_id in old_by_id if template_id not in new_by_id)
+        if not changed:
+            return []
+        
+        if [t['id'] for t in self.templates] == [t['id'] for t in old_templates]:
+            # Порядок библиотеки тот же: достаточно обновить ключи измененных шаблонов
+            keys = set()
+            for template_id in changed:
+                keys.add(self.index_key(old_by_id[template_id]))
+                keys.add(self.index_key(new_by_id[template_id]))
+                self.extraction_plans[template_id] = self.compile_extraction_plan(new_by_id[template_id])
+            self.rebuild_index(keys)
+        else:
+            self.rebuild_index()
+        return changed
+    
+    def index_key(self, template):
+        """Ключ индекса шаблонов"""
+        return (self.parse_fingerprint(template['fingerprint']), template.get('has_uvnk', False))
+    
+    def rebuild_index(self, keys=None):
+        """Перестраивает индекс шаблонов целиком или только для указанных ключей"""
+        if keys is None:
+            self.template_index = defaultdict(list)
+            self.extraction_plans = {}
+            for template in self.templates:
+                self.template_index[self.index_key(template)].append(template)
+                self.extraction_plans[template['id']] = self.compile_extraction_plan(template)
+            return
+        
+        for key in keys:
+            bucket = [t for t in self.templates if self.index_key(t) == key]
+            if bucket:
+                self.template_index[key] = bucket
+            else:
+                self.template_index.pop(key, None)
+    
+    @staticmethod
+    def compile_extraction_plan(template):
+        """Компилирует шаблон в план извлечения: [((row, col, rowspan, colspan), output_column), ...]"""
+        plan = []
+        for cell_def in template['cells']:
+            output_column = cell_def.get('output_column', '')
+            if output_column and output_column.strip():  # Только если output_column задан и не пустой
+                key = (cell_def['row'], cell_def['col'], cell_def['rowspan'], cell_def['colspan'])
+                plan.append((key, output_column))
+        return plan
+    
+    def get_extraction_plan(self, template):
+        """Возвращает план извлечения для шаблона"""
+        plan = self.extraction_plans.get(template['id'])
+        if plan is None:
+            plan = self.compile_extraction_plan(template)
+            self.extraction_plans[template['id']] = plan
+        return plan
+    
+    def layout_id(self, layout):
+        """Номер расположения ячеек ((row, col, rowspan, colspan), ...)"""
+        layout_id = self.layout_ids.get(layout)
+        if layout_id is None:
+            layout_id = len(self.layouts)
+            self.layout_ids[layout] = layout_id
+            self.layouts.append(layout)
+        return layout_id
+    
+    def fingerprint_key(self, cells):
+        """Компактный fingerprint группы: (номер расположения, битовая маска required).
+        
+        Ячейки (row, col, rowspan, colspan, required - атрибуты) идут по row, затем col
+        """
+        layout = tuple((cell.row, cell.col, cell.rowspan, cell.colspan) for cell in cells)
+        mask = 0
+        for bit, cell in enumerate(cells):
+            if cell.required:
+                mask |= 1 << bit
+        return (self.layout_id(layout), mask)
+    
+    def format_fingerprint(self, key):
+        """Строковая форма компактного fingerprint для показа и templates.json"""
+        layout_id, mask = key
+        parts = []
+        for bit, (row, col, rowspan, colspan) in enumerate(self.layouts[layout_id]):
+            required = 'true' if mask >> bit & 1 else 'false'
+            parts.append(f"{rowspan}x{colspan}_{row}_{col}_{required}")
+        return "|".join(parts)
+    
+    def parse_fingerprint(self, fingerprint):
+        """Компактный ключ строкового fingerprint; строка нестандартного вида остается как есть"""
+        try:
+            layout = []
+            mask = 0
+            for bit, part in enumerate(fingerprint.split('|')):
+                size, row, col, required = part.split('_')
+                rowspan, colspan = size.split('x')
+                layout.append((int(row), int(col), int(rowspan), int(colspan)))
+                if required == 'true':
+                    mask |= 1 << bit
+                elif required != 'false':
+                    return fingerprint
+        except ValueError:
+            return fingerprint
+        
+        key = (self.layout_id(tuple(layout)), mask)
+        # Такая строка не совпала бы со строкой группы - и ключ не должен
+        if self.format_fingerprint(key) != fingerprint:
+            return fingerprint
+        return key
+    
+    def generate_fingerprint(self, cells):
+        """Генерирует строковый fingerprint из списка ячеек"""
+        # Сортируем ячейки по row, затем col
+        return self.format_fingerprint(self.fingerprint_key(sorted(cells, key=lambda x: (x.row, x.col))))
+    
+    def find_template(self, sheet_name, group_fingerprint, has_uvnk):
+        """Ищет шаблон для группы по компактному или строковому fingerprint"""
+        if isinstance(group_fingerprint, str):
+            group_fingerprint = self.parse_fingerprint(group_fingerprint)
+        
+        # Кандидаты с совпадающими fingerprint и режимом увнк, в порядке библиотеки
+        for template in self.template_index.get((group_fingerprint, has_uvnk), ()):
+            # Проверяем, что подстрока sheet содержится в названии листа
+            if template['sheet'] in sheet_name:
+                return template
+        return None
+    
+    def load_examples(self):
+        """Возвращает вынесенные примеры: id шаблона -> список полей примеров по ячейкам"""
+        if self.examples is None:
+            self.examples = {}
+            try:
+                if self.persist and os.path.exists(self.examples_file):
+                    with open(self.examples_file, 'r', encoding='utf-8') as f:
+                        self.examples = json.load(f)
+            except Exception as e:
+                print(f"Error loading template examples: {e}", file=sys.stderr)
+        return self.examples
+    
+    def save_examples(self):
+        """Атомарно сохраняет вынесенные примеры"""
+        if not self.persist:
+            return True
+        try:
+            tmp_file = self.examples_file + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.load_examples(), f, ensure_ascii=False, default=str)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.examples_file)
+            return True
+        except Exception as e:
+            print(f"Error saving template examples: {e}", file=sys.stderr)
+            return False
+    
+    def cell_examples(self, template):
+        """Пример и абсолютная позиция каждой ячейки шаблона (из шаблона или из файла примеров)"""
+        stored = self.load_examples().get(template['id'], [])
+        examples = []
+        for i, cell in enumerate(template['cells']):
+            example = stored[i] if i < len(stored) else {}
+            examples.append({field: cell.get(field, example.get(field)) for field in EXAMPLE_FIELDS})
+        return examples
+    
+    def shadowed_templates(self):
+        """Шаблоны, которые никогда не будут найдены: раньше в библиотеке есть шаблон
+        с тем же fingerprint и увнк, чей sheet - подстрока их sheet.
+        
+        Возвращает список (id шаблона, id перекрывающего шаблона)
+        """
+        shadowed = []
+        for bucket in self.template_index.values():
+            for i, template in enumerate(bucket):
+                for earlier in bucket[:i]:
+                    if earlier['sheet'] in template['sheet']:
+                        shadowed.append((template['id'], earlier['id']))
+                        break
+        return shadowed
+    
+    def compact(self, move_examples=True):
+        """Сжимает библиотеку: сливает шаблоны с одинаковыми sheet, fingerprint и увнк
+        (output_column дубликатов переносятся в пустые ячейки оставшегося) и выносит
+        примеры ячеек в отдельный файл. Изменения сразу сохраняются.
+        
+        Возвращает отчет: merged, conflicts, shadowed, examples_moved
+        """
+        report = {'merged': {}, 'conflicts': [], 'shadowed': [], 'examples_moved': 0}
+        
+        # Первый шаблон с ключом - тот, который находит find_template
+        kept = {}
+        templates = []
+        for template in self.templates:
+            key = (template['sheet'], self.index_key(template))
+            first = kept.get(key)
+            if first is None:
+                kept[key] = template
+                templates.append(template)
+                continue
+            
+            report['merged'][template['id']] = first['id']
+            first_cells = {
+                (c['row'], c['col'], c['rowspan'], c['colspan']): c for c in first['cells']
+            }
+            for cell in template['cells']:
+                output_column = (cell.get('output_column') or '').strip()
+                target = first_cells.get((cell['row'], cell['col'], cell['rowspan'], cell['colspan']))
+                if not output_column or target is None:
+                    continue
+                current = (target.get('output_column') or '').strip()
+                if not current:
+                    target['output_column'] = cell['output_column']
+                elif current != output_column:
+                    report['conflicts'].append({
+                        'id': first['id'],
+                        'duplicate': template['id'],
+                        'cell': [cell['row'], cell['col']],
+                        'kept': current,
+                        'dropped': output_column
+                    })
+        
+        examples = self.load_examples()
+        if move_examples:
+            for template in templates:
+                moved = self.cell_examples(template)
+                if any(field in cell for cell in template['cells'] for field in EXAMPLE_FIELDS):
+                    examples[template['id']] = moved
+                    for cell in template['cells']:
+                        for field in EXAMPLE_FIELDS:
+                            cell.pop(field, None)
+                    report['examples_moved'] += 1
+        
+        # Примеры удаленных шаблонов больше не нужны
+        known_ids = {t['id'] for t in templates}
+        for template_id in [t for t in examples if t not in known_ids]:
+            del examples[template_id]
+        
+        self.templates = templates
+        self.rebuild_index()
+        report['shadowed'] = [
+            {'id': template_id, 'shadowed_by': earlier_id}
+            for template_id, earlier_id in self.shadowed_templates()
+        ]
+        
+        # Сначала примеры: при сбое между записями они просто останутся и в шаблонах
+        self.save_examples()
+        self.save_templates()
+        return report
+    
+    def create_new_template(self, sheet_name, group_cells, has_uvnk, description=""):
+        """Создает новый шаблон из группы ячеек"""
+        fingerprint = self.generate_fingerprint(group_cells)
+        
+        # Создаем ячейки для шаблона
+        template_cells = []
+        for cell in group_cells:
+            template_cell = {
+                'row': cell.row,
+                'col': cell.col,
+                'rowspan': cell.rowspan,
+                'colspan': cell.colspan,
+                'required': cell.required,
+                'output_column': '',  # Пользователь заполнит позже
+                'example': cell.value,
+                'absolute_position': {
+                    'row': cell.absolute_row,
+                    'col': cell.absolute_col
+                }
+            }
+            template_cells.append(template_cell)
+        
+        new_template = {
+            'id': '',
+            'name': f'Автошаблон для {sheet_name}',
+            'sheet': sheet_name,
+            'has_uvnk': has_uvnk,
+            'description': description,
+            'fingerprint': fingerprint,
+            'cells': template_cells
+        }
+        
+        return self.add_template(new_template)
+    
+    def add_template(self, new_template):
+        """Добавляет шаблон в библиотеку под новым id"""
+        new_template['id'] = f'template_{int(time.time())}_{len(self.templates)}'
+        
+        self.templates.append(new_template)
+        self.template_index[self.index_key(new_template)].append(new_template)
+        self.extraction_plans[new_template['id']] = self.compile_extraction_plan(new_template)
+        self.write_journal({'op': 'create', 'template': new_template})
+        
+        return new_template
+    
+    def update_template(self, template_id, updates):
+        """Обновляет существующий шаблон"""
+        for template in self.templates:
+            if template['id'] == template_id:
+                old_key = self.index_key(template)
+                template.update(updates)
+                new_key = self.index_key(template)
+                if new_key != old_key:
+                    self.rebuild_index([old_key, new_key])
+                self.extraction_plans[template_id] = self.compile_extraction_plan(template)
+                self.write_journal({'op': 'update', 'id': template_id, 'updates': updates})
+                return True
+        return False
@@ -0,0 +1,286 @@
+import sys
+import os
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from greenTableTemplates import TemplateManager
+from greenTableEngine import process_files
+from greenTableOutput import open_sink, close_sink
+from greenTableCache import ResultCache, Quarantine
+from greenTableTelemetry import MatchTelemetry
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # Без watchdog директория опрашивается по таймеру
+    Observer = None
+    FileSystemEventHandler = object
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+
+def is_excel_file(path):
+    """Файл Excel, кроме файлов блокировки ~$..., которые Excel держит рядом с открытой книгой"""
+    name = os.path.basename(path)
+    return name.lower().endswith(EXCEL_EXTENSIONS) and not name.startswith('~$')
+
+def file_state(path):
+    """(размер, mtime) файла или None, если файла нет"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+class ChangeHandler(FileSystemEventHandler):
+    """Собирает пути из событий watchdog; разбираются они в основном потоке"""
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        for path in (event.src_path, getattr(event, 'dest_path', None)):
+            if path and is_excel_file(path):
+                self.watcher.touch(path)
+
+class FolderWatcher:
+    """Следит за новыми, измененными и удаленными файлами Excel в директории.
+
+    С watchdog (inotify и аналоги) проверяются только пути из событий, без него
+    дерево обходится при каждом опросе. Файл отдается на разбор, когда его размер
+    и время изменения не менялись debounce секунд (файл дописан)
+    """
+    def __init__(self, directory, debounce=5.0, use_events=True):
+        self.directory = directory
+        self.debounce = debounce
+        # Обработанные файлы: путь -> состояние на момент разбора
+        self.known = {}
+        # Новые или измененные файлы: путь -> (состояние, когда оно замечено)
+        self.pending = {}
+        self.touched = set()
+        self.lock = threading.Lock()
+        self.observer = None
+        if use_events and Observer is not None:
+            self.observer = Observer()
+            self.observer.schedule(ChangeHandler(self), directory, recursive=True)
+            self.observer.start()
+        # Первый проход всегда полный: файлы, появившиеся до запуска
+        self.full_scan = True
+
+    def touch(self, path):
+        with self.lock:
+            self.touched.add(path)
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+    def walk(self):
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if is_excel_file(path):
+                    yield path
+
+    def poll(self):
+        """Возвращает (готовые к разбору файлы, удаленные файлы)"""
+        if self.observer is None or self.full_scan:
+            paths = set(self.walk())
+            # Файлы, которых больше нет в дереве, тоже проверяются - они удалены
+            paths.update(self.known)
+            paths.update(self.pending)
+            self.full_scan = False
+        else:
+            with self.lock:
+                paths, self.touched = self.touched, set()
+            paths.update(self.pending)
+
+        now = time.monotonic()
+        ready = []
+        removed = []
+        for path in sorted(paths):
+            state = file_state(path)
+            if state is None:
+                self.pending.pop(path, None)
+                if self.known.pop(path, None) is not None:
+                    removed.append(path)
+                continue
+            if self.known.get(path) == state:
+                self.pending.pop(path, None)
+                continue
+            seen_state, seen_at = self.pending.get(path, (None, None))
+            if seen_state != state:
+                # Файл еще пишется: ждем, пока он не перестанет меняться
+                self.pending[path] = (state, now)
+            elif now - seen_at >= self.debounce:
+                ready.append(path)
+        return ready, removed
+
+    def requeue_removed(self, paths):
+        """Удаленные файлы, удаление которых не записалось, снова отдаются при следующем опросе"""
+        with self.lock:
+            for path in paths:
+                self.known[path] = (None, None)
+                self.touched.add(path)
+
+    def mark_done(self, path):
+        """Запоминает состояние файла, с которым он разобран"""
+        state, _ = self.pending.pop(path, (None, None))
+        if state is not None:
+            self.known[path] = state
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Слежение за директорией: новые и измененные журналы Excel разбираются по мере появления"
+    )
+    parser.add_argument("directory", help="Директория с файлами Excel (обходится рекурсивно)")
+    parser.add_argument("-o", "--output", default="output.xlsx",
+                        help="Выходной файл: .xlsx, .csv или база .sqlite/.db (по умолчанию output.xlsx)")
+    parser.add_argument("-t", "--templates", default="templates.json", help="Файл библиотеки шаблонов")
+    parser.add_argument("--auto-create", dest="auto_create", action="store_true", default=True,
+                        help="Создавать шаблоны для неизвестных структур (по умолчанию)")
+    parser.add_argument("--no-auto-create", dest="auto_create", action="store_false",
+                        help="Не создавать новые шаблоны")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="Количество процессов")
+    parser.add_argument("--cache-dir", default=".greentable_cache",
+                        help="Директория кеша результатов по файлам")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Предел времени на файл, секунд (файл разбирается в отдельном процессе)")
+    parser.add_argument("--memory-limit", type=int, default=None,
+                        help="Предел памяти процесса разбора файла, МБ")
+    parser.add_argument("--interval", type=float, default=2.0, help="Период опроса, секунд")
+    parser.add_argument("--debounce", type=float, default=5.0,
+                        help="Сколько секунд файл не должен меняться перед разбором")
+    parser.add_argument("--poll", action="store_true", help="Опрашивать директорию даже при наличии watchdog")
+    parser.add_argument("--once", action="store_true", help="Разобрать готовые файлы и завершиться")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Не выводить лог обработки")
+    return parser.parse_args(argv)
+
+def process_batch(args, watcher, ready, removed, template_manager, cache, quarantine, telemetry, log):
+    """Разбирает готовые файлы и дописывает результат в выходной файл, возвращает сводку"""
+    start_time = time.time()
+    stats = Counter()
+
+    # Измененные вне процесса шаблоны подхватываются без перезагрузки всей библиотеки
+    changed = template_manager.reload_changed()
+    if changed:
+        log(f"Reloaded {len(changed)} changed templates from {args.templates}")
+
+    sink = open_sink(args.output)
+    if sink.incremental:
+        # В базе остаются строки прочих файлов: пишем только изменения
+        excel_files = ready
+        unsettled = set()
+    else:
+        # Файл пишется целиком: неизмененные файлы берутся из кеша, а те, что еще
+        # дописываются, - из последнего разбора (разберутся, когда будут готовы)
+        excel_files = sorted(set(watcher.known) | set(ready))
+        unsettled = set(watcher.pending) - set(ready)
+
+    # Файлы пачки считаются обработанными, только когда результат записан
+    done = []
+
+    ready_files = set(ready)
+
+    def file_done(input_file, rows, ok):
+        # Файл с ошибкой тоже запоминается: повторно он разбирается, когда изменится
+        if input_file in ready_files:
+            done.append(input_file)
+
+    try:
+        if sink.incremental:
+            for input_file in removed:
+                sink.remove_file(input_file)
+        _, new_templates_created = process_files(
+            excel_files,
+            template_manager,
+            auto_create=args.auto_create,
+            workers=args.workers,
+            log=log,
+            file_done=file_done,
+            stats=stats,
+            cache=cache,
+            sink=sink,
+            timeout=args.timeout,
+            memory_limit=args.memory_limit,
+            quarantine=quarantine,
+            telemetry=telemetry,
+            unsettled=unsettled
+        )
+    except Exception:
+        sink.abort()
+        raise
+    try:
+        close_sink(sink, template_manager, log)
+    finally:
+        template_manager.flush()
+    for input_file in done:
+        watcher.mark_done(input_file)
+
+    return {
+        'files': len(ready),
+        'removed': len(removed),
+        'parsed_files': stats['files'] - stats['cached_files'],
+        'failed_files': stats['failed_files'],
+        'quarantined_files': stats['quarantined_files'],
+        'new_templates': len(new_templates_created),
+        'rows': stats['rows'],
+        'elapsed': round(time.time() - start_time, 3),
+    }
+
+def run(args):
+    if args.quiet:
+        def log(message):
+            pass
+    else:
+        def log(message):
+            print(message, file=sys.stderr)
+
+    if not os.path.isdir(args.directory):
+        log(f"Directory not found: {args.directory}")
+        return 2
+
+    # Библиотека и ее индекс живут в памяти все время работы
+    template_manager = TemplateManager(args.templates)
+    if template_manager.load_error is not None:
+        log(f"Error loading {args.templates}: {template_manager.load_error}")
+        return 2
+    cache = ResultCache(args.cache_dir)
+    quarantine = Quarantine(args.cache_dir)
+    telemetry = MatchTelemetry(args.cache_dir)
+    watcher = FolderWatcher(args.directory, args.debounce, use_events=not args.poll)
+    log(f"Loaded {len(template_manager.templates)} templates from {args.templates}")
+    log(f"Watching {args.directory} ({'events' if watcher.observer is not None else 'polling'}), "
+        f"output {args.output}")
+
+    try:
+        while True:
+            ready, removed = watcher.poll()
+            if ready or removed:
+                try:
+                    summary = process_batch(args, watcher, ready, removed, template_manager, cache, quarantine,
+                                            telemetry, log)
+                    print(json.dumps(summary, ensure_ascii=False), flush=True)
+                except Exception as e:
+                    # Ошибка записи результата не останавливает слежение: файлы пачки остаются
+                    # в очереди и разбираются снова при следующем опросе
+                    log(f"Error processing batch: {str(e)}")
+                    watcher.requeue_removed(removed)
+            elif args.once and not watcher.pending:
+                return 0
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        log("Stopped")
+        return 0
+    finally:
+        watcher.stop()
+        template_manager.flush()
+
+def main(argv=None):
+    return run(parse_args(argv))
+
+if __name__ == '__main__':
+    sys.exit(main())